@@ -0,0 +1,235 @@
+import json
+import os
+import struct
+import threading
+
+import streamlit as st
+
+from image_store import externalize_image
+
+# --- Configuration ---
+CHAT_HISTORY_DIR = "chat_history"
+LOG_SUFFIX = ".jsonl"
+INDEX_SUFFIX = ".idx"
+# ข้อความที่ยังมีรูป base64 อยู่ในบรรทัด (ล็อกที่ถูก migrate ก่อนมีการแยกรูปไปเก็บใน image store)
+INLINE_IMAGE_MARKER = b'"image": '
+# Each index entry is the byte offset of one message line (little-endian uint64)
+OFFSET_FORMAT = "<Q"
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+
+
+class ChatHistoryStore:
+    """
+    เก็บประวัติการแชทแบบ append-only (JSON Lines) หนึ่งไฟล์ต่อเครื่องจักร
+
+    แต่ละข้อความเป็นหนึ่งบรรทัดใน {machine}.jsonl และตำแหน่ง byte ของแต่ละบรรทัด
+    ถูกเก็บใน {machine}.idx ทำให้อ่านเฉพาะ N ข้อความล่าสุดได้โดยไม่ต้อง parse ทั้งไฟล์
+    """
+    def __init__(self, root=CHAT_HISTORY_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._checked = set()
+
+    def _paths(self, machine_name):
+        safe_name = machine_name.replace(os.sep, "_").replace("/", "_")
+        base = os.path.join(self.root, safe_name)
+        return base + LOG_SUFFIX, base + INDEX_SUFFIX
+
+    def _lock(self, machine_name):
+        with self._locks_guard:
+            return self._locks.setdefault(machine_name, threading.Lock())
+
+    def _read_offsets(self, index_path):
+        if not os.path.exists(index_path):
+            return []
+        with open(index_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % OFFSET_SIZE
+        return [offset for (offset,) in struct.iter_unpack(OFFSET_FORMAT, data[:usable])]
+
+    def _recover(self, machine_name):
+        """
+        ซ่อมไฟล์หลังโปรแกรมหยุดกลางการเขียน: ตัดบรรทัดที่เขียนไม่ครบ และเติม index ที่ขาด
+
+        ทำครั้งเดียวต่อเครื่องจักรต่อ process งานเป็นสัดส่วนกับส่วนที่ยังไม่มี index เท่านั้น
+        """
+        if machine_name in self._checked:
+            return
+        log_path, index_path = self._paths(machine_name)
+        self._migrate_legacy(machine_name)
+        if not os.path.exists(log_path):
+            self._checked.add(machine_name)
+            return
+        self._externalize_inline_images(machine_name)
+
+        offsets = self._read_offsets(index_path)
+        size = os.path.getsize(log_path)
+        # Drop index entries that point past the end of the log
+        while offsets and offsets[-1] >= size:
+            offsets.pop()
+        start = offsets[-1] if offsets else 0
+        if offsets:
+            offsets.pop()  # re-verify the last indexed line
+
+        with open(log_path, "rb") as f:
+            f.seek(start)
+            tail = f.read()
+        position = start
+        for line in tail.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break
+            offsets.append(position)
+            position += len(line)
+        if position < size:
+            # Partial last line from an interrupted write
+            with open(log_path, "r+b") as f:
+                f.truncate(position)
+
+        with open(index_path, "wb") as f:
+            f.write(b"".join(struct.pack(OFFSET_FORMAT, offset) for offset in offsets))
+        self._checked.add(machine_name)
+
+    def _migrate_legacy(self, machine_name):
+        """
+        นำเข้าไฟล์ {machine}.json แบบเดิม (ทั้งไฟล์เป็น list) ครั้งแรกที่เปิดใช้ store
+        """
+        log_path, _ = self._paths(machine_name)
+        legacy_path = f"{machine_name}.json"
+        if os.path.exists(log_path) or not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                messages = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return
+        # ย้ายรูป base64 ไปไว้ใน image store ครั้งเดียวตอนนำเข้า ล็อกจึงเก็บเฉพาะ image_hash
+        self._append_many(machine_name, [externalize_image(message) for message in messages])
+
+    def _externalize_inline_images(self, machine_name):
+        """
+        เขียนล็อกใหม่โดยย้ายรูป base64 ที่ยังค้างอยู่ในบรรทัดไปไว้ใน image store (ทำครั้งเดียว)
+        """
+        log_path, index_path = self._paths(machine_name)
+        with open(log_path, "rb") as f:
+            data = f.read()
+        if INLINE_IMAGE_MARKER not in data:
+            return
+        lines = []
+        for line in data.splitlines(keepends=True):
+            if INLINE_IMAGE_MARKER in line and line.endswith(b"\n"):
+                try:
+                    message = externalize_image(json.loads(line))
+                except (json.JSONDecodeError, ValueError):
+                    pass
+                else:
+                    line = (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+            lines.append(line)
+        tmp_path = f"{log_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, log_path)
+        # Offsets changed; _recover rebuilds the index from the start of the log
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+    def _append_many(self, machine_name, messages):
+        log_path, index_path = self._paths(machine_name)
+        lines = [(json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8") for message in messages]
+        if not lines:
+            return
+        # O_APPEND makes each write land at the current end of file, even across sessions
+        fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            position = os.fstat(fd).st_size
+            os.write(fd, b"".join(lines))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        entries = []
+        for line in lines:
+            entries.append(struct.pack(OFFSET_FORMAT, position))
+            position += len(line)
+        with open(index_path, "ab") as f:
+            f.write(b"".join(entries))
+
+    def append(self, machine_name, message):
+        """
+        เพิ่มข้อความหนึ่งข้อความต่อท้ายประวัติ (ไม่เขียนไฟล์ทั้งไฟล์ใหม่)
+        """
+        with self._lock(machine_name):
+            self._recover(machine_name)
+            self._append_many(machine_name, [message])
+
+    def count(self, machine_name):
+        """
+        คืนค่าจำนวนข้อความทั้งหมดของเครื่องจักร
+        """
+        with self._lock(machine_name):
+            self._recover(machine_name)
+            return len(self._read_offsets(self._paths(machine_name)[1]))
+
+    def load(self, machine_name, last_n=None):
+        """
+        โหลดประวัติการแชท (ระบุ last_n เพื่ออ่านเฉพาะข้อความล่าสุด)
+        """
+        if last_n is None:
+            return self.load_range(machine_name, 0)
+        if last_n <= 0:
+            return []
+        return self.load_range(machine_name, -last_n)
+
+    def load_range(self, machine_name, start, stop=None):
+        """
+        โหลดข้อความลำดับที่ start ถึง stop (ไม่รวม stop) แบบเดียวกับ slice ของ list
+
+        ใช้ index หา byte offset จึงอ่านเฉพาะช่วงที่ต้องการ เช่นอ่านย้อนหลังทีละหน้า
+        """
+        log_path, index_path = self._paths(machine_name)
+        with self._lock(machine_name):
+            self._recover(machine_name)
+            if not os.path.exists(log_path):
+                return []
+            offsets = self._read_offsets(index_path)
+            start, stop, _ = slice(start, stop).indices(len(offsets))
+            if start >= stop:
+                return []
+            with open(log_path, "rb") as f:
+                f.seek(offsets[start])
+                if stop < len(offsets):
+                    data = f.read(offsets[stop] - offsets[start])
+                else:
+                    data = f.read()
+
+        messages = []
+        for line in data.splitlines():
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return messages
+
+    def clear(self, machine_name):
+        """
+        ลบประวัติการแชทของเครื่องจักร
+        """
+        with self._lock(machine_name):
+            for path in self._paths(machine_name):
+                if os.path.exists(path):
+                    os.remove(path)
+            # Keep the legacy file from being imported again
+            legacy_path = f"{machine_name}.json"
+            if os.path.exists(legacy_path):
+                os.replace(legacy_path, legacy_path + ".bak")
+            self._checked.add(machine_name)
+
+
+@st.cache_resource
+def get_chat_store(root=CHAT_HISTORY_DIR):
+    """
+    ChatHistoryStore หนึ่งตัวต่อ process (แชร์ lock ร่วมกันทุก session)
+    """
+    return ChatHistoryStore(root)
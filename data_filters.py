@@ -0,0 +1,172 @@
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from data_index import get_value_index
+from data_schema import DISPLAY_TIMEZONE
+
+# --- Filter Configuration ---
+TEXT_SEARCH_COLUMNS = ["Diagnostic", "Comment"]
+PAGE_SIZES = [25, 50, 100, 250]
+OPERATORS = {
+    "==": "equals",
+    "isin": "is one of",
+    "between": "between",
+    "contains": "contains",
+}
+
+
+class Condition(NamedTuple):
+    """
+    เงื่อนไขเดียวบนคอลัมน์เดียว
+
+    op: '==' (value), 'isin' (tuple ของค่า), 'between' ((low, high) ใส่ None ได้), 'contains' (ข้อความ)
+    """
+    column: str
+    op: str
+    value: object
+
+
+class FilterSpec(NamedTuple):
+    """
+    กลุ่มของเงื่อนไขที่รวมกันด้วย 'and' หรือ 'or' (ซ้อน FilterSpec ได้)
+    """
+    conditions: tuple
+    combine: str = "and"
+
+
+def operators_for(dtype):
+    """
+    คืนค่า operator ที่ใช้ได้กับชนิดข้อมูลของคอลัมน์
+    """
+    if pd.api.types.is_bool_dtype(dtype):
+        return ["==", "isin"]
+    if pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype):
+        return ["==", "isin", "between"]
+    return ["==", "isin", "contains"]
+
+
+def spec_columns(spec):
+    """
+    คืนค่ารายชื่อคอลัมน์ทั้งหมดที่ FilterSpec อ้างถึง
+    """
+    columns = []
+    for cond in spec.conditions:
+        columns.extend(spec_columns(cond) if isinstance(cond, FilterSpec) else [cond.column])
+    return list(dict.fromkeys(columns))
+
+
+def _positions_to_mask(positions, num_rows):
+    mask = np.zeros(num_rows, dtype=bool)
+    mask[positions] = True
+    return mask
+
+
+def _as_bound(value, series):
+    """
+    แปลงขอบเขตของช่วงให้เทียบกับคอลัมน์ได้ (วันที่ -> Timestamp ตาม timezone ของคอลัมน์)
+    """
+    if value is None or not pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return value
+    bound = pd.Timestamp(value)
+    if bound.tzinfo is None:
+        bound = bound.tz_localize(getattr(series.dt, "tz", None) or DISPLAY_TIMEZONE)
+    return bound
+
+
+def _contains_mask(series, text):
+    """
+    ค้นหาข้อความแบบไม่สนตัวพิมพ์เล็ก/ใหญ่ (categorical จะค้นหาเฉพาะใน categories)
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories.astype(str)
+        matched = np.flatnonzero(categories.str.contains(text, case=False, regex=False))
+        return np.isin(series.cat.codes.to_numpy(), matched)
+    return series.astype("string").str.contains(text, case=False, regex=False, na=False).to_numpy(dtype=bool)
+
+
+def condition_mask(df, cond, version):
+    """
+    คำนวณ boolean mask ของเงื่อนไขเดียวแบบ vectorized
+    """
+    series = df[cond.column]
+    if cond.op in ("==", "isin"):
+        # Equality lookups go through the shared value index instead of a scan
+        index = get_value_index(version, cond.column, series)
+        values = [cond.value] if cond.op == "==" else list(cond.value)
+        positions = [index.positions(value, len(df)) for value in values]
+        return _positions_to_mask(np.concatenate(positions) if positions else np.empty(0, dtype=np.intp), len(df))
+    if cond.op == "between":
+        low, high = (_as_bound(bound, series) for bound in cond.value)
+        mask = series.notna().to_numpy(dtype=bool, copy=True)
+        if low is not None:
+            mask &= (series >= low).to_numpy(dtype=bool, na_value=False)
+        if high is not None:
+            mask &= (series <= high).to_numpy(dtype=bool, na_value=False)
+        return mask
+    if cond.op == "contains":
+        return _contains_mask(series, str(cond.value))
+    raise ValueError(f"Unknown filter operator: {cond.op}")
+
+
+def spec_mask(df, spec, version):
+    """
+    คำนวณ boolean mask ของ FilterSpec (รวมเงื่อนไขย่อยด้วย and/or)
+    """
+    if not spec.conditions:
+        return np.ones(len(df), dtype=bool)
+    masks = [
+        spec_mask(df, cond, version) if isinstance(cond, FilterSpec) else condition_mask(df, cond, version)
+        for cond in spec.conditions
+    ]
+    combine = np.logical_or if spec.combine == "or" else np.logical_and
+    return combine.reduce(masks)
+
+
+@st.cache_resource(show_spinner=False, max_entries=256)
+def get_filter_positions(version, spec, _df):
+    """
+    คำนวณตำแหน่งแถวที่ผ่านเงื่อนไข เก็บผลไว้ต่อ (เวอร์ชันข้อมูล, FilterSpec)
+    """
+    return np.flatnonzero(spec_mask(_df, spec, version))
+
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def get_sorted_positions(version, spec, sort_column, ascending, _df):
+    """
+    ตำแหน่งแถวที่ผ่านเงื่อนไขเรียงตาม sort_column (stable sort, ค่าว่างอยู่ท้ายสุด)
+    """
+    if spec.conditions:
+        positions = get_filter_positions(version, spec, _df)
+    else:
+        positions = np.arange(len(_df))
+    if not sort_column:
+        return positions
+    keys = _df[sort_column].take(positions).reset_index(drop=True)
+    order = keys.sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+    return positions[order]
+
+
+def get_page(df, spec, version, page=1, page_size=PAGE_SIZES[1], sort_column=None, ascending=True):
+    """
+    คืนค่า (DataFrame เฉพาะหน้าที่เลือก, จำนวนแถวทั้งหมด) สำหรับแบ่งหน้าฝั่ง server
+
+    คอลัมน์ object/string ถูกแปลงเป็น str เฉพาะแถวในหน้านั้นเพื่อส่งไปแสดงผล
+    """
+    positions = get_sorted_positions(version, spec, sort_column, ascending, df)
+    start = (max(page, 1) - 1) * page_size
+    page_df = df.take(positions[start:start + page_size])
+    # Stringify only the visible slice to avoid Arrow serialization errors
+    for col in page_df.columns:
+        if pd.api.types.is_object_dtype(page_df[col].dtype):
+            page_df[col] = page_df[col].astype(str)
+    return page_df, len(positions)
+
+
+def text_search_spec(text, columns):
+    """
+    สร้างเงื่อนไขค้นหาข้อความในหลายคอลัมน์ (รวมด้วย or)
+    """
+    return FilterSpec(tuple(Condition(col, "contains", text) for col in columns), "or")
@@ -0,0 +1,108 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from data_loader import get_lineage
+
+ALL_VALUES = "All"
+
+
+class ValueIndex:
+    """
+    Inverted index ของคอลัมน์เดียว: ค่า -> ตำแหน่งแถว (row positions)
+
+    รองรับการต่อแถวใหม่ด้วย extend() โดยไม่สร้าง index ใหม่ทั้งหมด
+    """
+    def __init__(self, series):
+        self.column = series.name
+        self.num_rows = 0
+        self.values = []
+        self._groups = []
+        self._pending = {}
+        self._lookup = {}
+        self._na_group = None
+        self.lock = threading.Lock()
+        self.extend(series)
+
+    def _group_of(self, value):
+        return self._na_group if pd.isna(value) else self._lookup.get(value)
+
+    def extend(self, series):
+        """
+        เพิ่มแถวใหม่ (ต่อท้าย) เข้า index งานที่ทำเป็นสัดส่วนกับจำนวนแถวใหม่เท่านั้น
+        """
+        # NaN gets its own code so empty cells can be selected too
+        codes, uniques = pd.factorize(series, use_na_sentinel=False)
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes, minlength=len(uniques))
+        with self.lock:
+            chunks = np.split(order + self.num_rows, np.cumsum(counts)[:-1]) if len(uniques) else []
+            for value, chunk in zip(uniques, chunks):
+                group = self._group_of(value)
+                if group is None:
+                    group = len(self.values)
+                    self.values.append(value)
+                    self._groups.append(chunk)
+                    if pd.isna(value):
+                        self._na_group = group
+                    else:
+                        self._lookup[value] = group
+                else:
+                    # Merged lazily on the next lookup of this value
+                    self._pending.setdefault(group, []).append(chunk)
+            self.num_rows += len(series)
+
+    def __len__(self):
+        return len(self.values)
+
+    def positions(self, value, num_rows=None):
+        """
+        คืนค่าตำแหน่งแถวของค่าที่เลือก (array ว่างถ้าไม่พบ)
+
+        ระบุ num_rows เพื่อตัดตำแหน่งของแถวที่ถูกต่อท้ายหลังจาก frame ของผู้เรียก
+        (index แชร์กันและอาจถูก extend โดย session อื่นที่เห็นข้อมูลใหม่กว่าแล้ว)
+        """
+        group = self._group_of(value)
+        if group is None:
+            return np.empty(0, dtype=np.intp)
+        with self.lock:
+            if group in self._pending:
+                self._groups[group] = np.concatenate([self._groups[group]] + self._pending.pop(group))
+            positions = self._groups[group]
+        if num_rows is not None:
+            # Positions are ascending within a group
+            positions = positions[:np.searchsorted(positions, num_rows)]
+        return positions
+
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def _get_index_holder(lineage, column):
+    return {"index": None, "lock": threading.Lock()}
+
+
+def get_value_index(version, column, _series):
+    """
+    ValueIndex หนึ่งตัวต่อ (snapshot ฐาน, คอลัมน์) แชร์ร่วมกันทุก session
+
+    เมื่อมีแถวต่อท้ายไฟล์ จะเพิ่มเฉพาะแถวใหม่เข้า index เดิม
+    """
+    holder = _get_index_holder(get_lineage(version), column)
+    with holder["lock"]:
+        index = holder["index"]
+        if index is None:
+            index = holder["index"] = ValueIndex(_series)
+        elif index.num_rows < len(_series):
+            index.extend(_series.iloc[index.num_rows:])
+        elif index.num_rows > len(_series):
+            # A frame from an older version: build a throwaway index for it
+            return ValueIndex(_series)
+    return index
+
+
+def get_filter_options(index):
+    """
+    คืนค่าตัวเลือกสำหรับ selectbox ('All' ตามด้วยค่าที่ไม่ซ้ำตามลำดับที่พบ)
+    """
+    return [ALL_VALUES] + index.values
@@ -0,0 +1,461 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import streamlit as st
+
+from data_schema import append_frames, compact_frame, conform_frame
+
+# --- Configuration ---
+DEFAULT_DATA_FILE = "merged_data.csv"
+
+# Columnar snapshot written next to the CSV (e.g. merged_data.feather)
+SNAPSHOT_SUFFIX = ".feather"
+SNAPSHOT_COMPRESSION = "zstd"
+SNAPSHOT_METADATA_KEY = b"v3chat.source"
+SNAPSHOT_REPORT_KEY = b"v3chat.compaction"
+# Rebuild the snapshot once appended rows exceed this share of the bytes it covers
+SNAPSHOT_REBUILD_RATIO = 0.5
+# Bytes hashed at both ends of the covered prefix to detect a rewritten file
+DIGEST_BYTES = 4096
+
+
+def get_file_signature(file_path):
+    """
+    คืนค่า (path, mtime, size) ของไฟล์ ใช้เป็น key ของ cache
+    """
+    stat = os.stat(file_path)
+    return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+
+def make_unique_columns(columns):
+    """
+    เปลี่ยนชื่อคอลัมน์ที่ซ้ำกันให้ไม่ซ้ำ (Name, Name_1, Name_2, ...)
+    """
+    seen = {}
+    unique = []
+    for col in columns:
+        if col in seen:
+            seen[col] += 1
+            unique.append(f"{col}_{seen[col]}")
+        else:
+            seen[col] = 0
+            unique.append(col)
+    return unique
+
+
+def read_csv_header(file_path):
+    """
+    อ่านเฉพาะแถว header ของไฟล์ CSV
+    """
+    with open(file_path, "r", encoding="utf-8", newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def complete_rows_end(data):
+    """
+    คืนค่าตำแหน่ง byte ถัดจากแถวสุดท้ายที่สมบูรณ์ (ไม่ตัดกลางข้อความหลายบรรทัดในเครื่องหมายคำพูด)
+    """
+    total_quotes = data.count(b'"')
+    quotes_after = 0
+    end = len(data)
+    while end > 0:
+        pos = data.rfind(b"\n", 0, end)
+        if pos < 0:
+            return 0
+        quotes_after += data.count(b'"', pos + 1, end)
+        # A newline ends a row only when it is outside a quoted field
+        if (total_quotes - quotes_after) % 2 == 0:
+            return pos + 1
+        end = pos
+    return 0
+
+
+def parse_csv_bytes(data, names, has_header):
+    """
+    แปลงข้อมูล CSV (bytes) เป็น DataFrame ด้วย C engine
+    """
+    return pd.read_csv(
+        io.BytesIO(data),
+        engine="c",
+        header=0 if has_header else None,
+        names=names,
+        on_bad_lines="skip",
+        low_memory=False,
+    )
+
+
+def get_snapshot_path(file_path):
+    """
+    คืนค่า path ของไฟล์ snapshot ที่คู่กับไฟล์ CSV
+    """
+    return os.path.splitext(file_path)[0] + SNAPSHOT_SUFFIX
+
+
+def _prefix_digest(head, tail):
+    return hashlib.sha1(head + b"|" + tail).hexdigest()
+
+
+def _file_prefix_digest(file_path, covered):
+    """
+    digest ของส่วนต้นและส่วนท้ายของช่วงไฟล์ [0, covered) ใช้ตรวจว่าไฟล์ถูกต่อท้ายหรือถูกเขียนใหม่
+    """
+    with open(file_path, "rb") as f:
+        head = f.read(min(DIGEST_BYTES, covered))
+        f.seek(max(0, covered - DIGEST_BYTES))
+        tail = f.read(min(DIGEST_BYTES, covered))
+    return _prefix_digest(head, tail)
+
+
+def read_snapshot_schema(snapshot_path):
+    """
+    อ่าน schema ของ snapshot (ไม่อ่านข้อมูล) ผ่าน memory map
+    """
+    with pa.memory_map(snapshot_path, "r") as source:
+        return pa.ipc.open_file(source).schema
+
+
+def read_snapshot_stamp(snapshot_path):
+    """
+    คืนค่าข้อมูลช่วงของไฟล์ CSV ที่ snapshot ครอบคลุม (covered, rows, digest) หรือ None
+    """
+    if not os.path.exists(snapshot_path):
+        return None
+    try:
+        metadata = read_snapshot_schema(snapshot_path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    stamp = metadata.get(SNAPSHOT_METADATA_KEY)
+    return json.loads(stamp) if stamp else None
+
+
+def stamp_matches(file_path, stamp):
+    """
+    ตรวจว่าไฟล์ CSV ปัจจุบันยังขึ้นต้นด้วยข้อมูลที่ snapshot ครอบคลุม (ถูกต่อท้ายเท่านั้น)
+    """
+    if not stamp or "covered" not in stamp:
+        return False
+    covered = stamp["covered"]
+    if os.path.getsize(file_path) < covered:
+        return False
+    return _file_prefix_digest(file_path, covered) == stamp["digest"]
+
+
+def parse_snapshot_source(file_path):
+    """
+    อ่านไฟล์ CSV ถึงแถวสุดท้ายที่สมบูรณ์และ compact คืนค่า (DataFrame, report, stamp)
+    """
+    with open(file_path, "rb") as f:
+        data = f.read()
+    covered = complete_rows_end(data)
+    df = parse_csv_bytes(data[:covered], make_unique_columns(read_csv_header(file_path)), has_header=True)
+    df, report = compact_frame(df)
+    stamp = {
+        "covered": covered,
+        "rows": len(df),
+        "digest": _prefix_digest(data[:min(DIGEST_BYTES, covered)], data[max(0, covered - DIGEST_BYTES):covered]),
+    }
+    return df, report, stamp
+
+
+def write_snapshot(df, report, stamp, snapshot_path):
+    """
+    เขียน snapshot แบบ columnar (Feather/Arrow IPC บีบอัดด้วย zstd)
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SNAPSHOT_METADATA_KEY] = json.dumps(stamp).encode()
+    metadata[SNAPSHOT_REPORT_KEY] = json.dumps(report).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    # Write to a temporary file first so readers never see a half-written snapshot
+    tmp_path = f"{snapshot_path}.tmp-{os.getpid()}"
+    try:
+        feather.write_feather(table, tmp_path, compression=SNAPSHOT_COMPRESSION)
+        os.replace(tmp_path, snapshot_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return snapshot_path
+
+
+def build_snapshot(file_path, snapshot_path=None):
+    """
+    แปลงไฟล์ CSV เป็น snapshot แบบ columnar
+    """
+    snapshot_path = snapshot_path or get_snapshot_path(file_path)
+    return write_snapshot(*parse_snapshot_source(file_path), snapshot_path)
+
+
+class DatasetState:
+    """
+    สถานะการ ingest ของไฟล์ CSV หนึ่งไฟล์: snapshot ฐาน + แถวที่ต่อท้ายไฟล์เข้ามาภายหลัง
+
+    แถวใหม่ถูกอ่านจาก byte offset ล่าสุดเท่านั้น (ไม่อ่านทั้งไฟล์ซ้ำ)
+    snapshot ถูกสร้างใหม่เมื่อไฟล์ถูกเขียนทับ หรือส่วนที่ต่อท้ายใหญ่เกิน SNAPSHOT_REBUILD_RATIO
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.snapshot_path = get_snapshot_path(file_path)
+        self.lock = threading.RLock()
+        self.stamp = None
+        self.report = None
+        self.header = None
+        self.base_dtypes = None
+        self.base_frame = None
+        self.tail = None
+        self.offset = 0
+        self._seen = None
+
+    @property
+    def base_rows(self):
+        return self.stamp["rows"] if self.stamp else 0
+
+    @property
+    def num_rows(self):
+        return self.base_rows + (len(self.tail) if self.tail is not None else 0)
+
+    @property
+    def lineage(self):
+        """
+        ระบุ snapshot ฐาน: cache ที่ต่อแถวใหม่ได้จะผูกกับค่านี้แทนเวอร์ชันของไฟล์
+        """
+        return f"{self.stamp['covered']}:{self.stamp['digest']}" if self.stamp else None
+
+    def refresh(self):
+        """
+        ตรวจไฟล์และอ่านเฉพาะแถวที่ต่อท้ายเข้ามาใหม่
+        """
+        stat = os.stat(self.file_path)
+        seen = (stat.st_mtime_ns, stat.st_size)
+        if seen == self._seen:
+            return self
+        with self.lock:
+            if seen == self._seen:
+                return self
+            if self.stamp is None or not stamp_matches(self.file_path, self.stamp):
+                self._load_base()
+            self._ingest_tail()
+            if self.offset - self.stamp["covered"] > SNAPSHOT_REBUILD_RATIO * max(self.stamp["covered"], 1):
+                # Fold a large tail back into the snapshot to keep startup fast
+                self._load_base(rebuild=True)
+                self._ingest_tail()
+            self._seen = seen
+        return self
+
+    def _load_base(self, rebuild=False):
+        stamp = None if rebuild else read_snapshot_stamp(self.snapshot_path)
+        self.base_frame = None
+        if stamp_matches(self.file_path, stamp):
+            self.report = self._read_report()
+        else:
+            df, report, stamp = parse_snapshot_source(self.file_path)
+            self.report = report
+            try:
+                write_snapshot(df, report, stamp, self.snapshot_path)
+            except OSError:
+                # Read-only deployments: keep the parsed base in memory
+                self.base_frame = df
+        self.stamp = stamp
+        self.header = make_unique_columns(read_csv_header(self.file_path))
+        if self.base_frame is not None:
+            self.base_dtypes = self.base_frame.dtypes
+        else:
+            self.base_dtypes = read_snapshot_schema(self.snapshot_path).empty_table().to_pandas().dtypes
+        self.tail = None
+        self.offset = stamp["covered"]
+
+    def _read_report(self):
+        metadata = read_snapshot_schema(self.snapshot_path).metadata or {}
+        report = metadata.get(SNAPSHOT_REPORT_KEY)
+        return json.loads(report) if report else None
+
+    def _ingest_tail(self):
+        with open(self.file_path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = complete_rows_end(data)
+        if end == 0:
+            return
+        new = conform_frame(parse_csv_bytes(data[:end], self.header, has_header=False), self.base_dtypes)
+        new.index = pd.RangeIndex(self.num_rows, self.num_rows + len(new))
+        self.tail = new if self.tail is None else append_frames(self.tail, new)
+        self.offset += end
+
+    @property
+    def dtypes(self):
+        """
+        ชนิดข้อมูลของทุกคอลัมน์ (snapshot ฐาน + คอลัมน์ที่เพิ่งมีข้อมูลในแถวใหม่)
+        """
+        if self.tail is None:
+            return self.base_dtypes
+        extra = self.tail.dtypes[~self.tail.columns.isin(self.base_dtypes.index)]
+        return pd.concat([self.base_dtypes, extra])
+
+    def _read_base(self, columns):
+        if columns is not None:
+            columns = [col for col in columns if col in self.base_dtypes.index]
+        if self.base_frame is not None:
+            return self.base_frame if columns is None else self.base_frame[columns]
+        table = feather.read_table(self.snapshot_path, columns=columns, memory_map=True)
+        return table.to_pandas()
+
+    def read(self, columns=None, start=0):
+        """
+        อ่านคอลัมน์ที่ต้องการตั้งแต่แถว start (snapshot ผ่าน memory map + แถวใหม่ในหน่วยความจำ)
+        """
+        with self.lock:
+            tail, base_rows = self.tail, self.base_rows
+        if tail is not None and columns is not None:
+            tail = tail[[col for col in columns if col in tail.columns]]
+        if start >= base_rows:
+            df = tail.iloc[start - base_rows:] if tail is not None else self._read_base(columns).iloc[:0]
+            df = df.reset_index(drop=True)
+        else:
+            df = append_frames(self._read_base(columns), tail)
+            if start:
+                df = df.iloc[start:].reset_index(drop=True)
+        if columns is not None:
+            df = df.reindex(columns=list(columns))
+        return df
+
+
+@st.cache_resource(show_spinner=False)
+def _get_state(abs_path):
+    """
+    DatasetState หนึ่งตัวต่อไฟล์ แชร์ร่วมกันทั้ง process
+    """
+    return DatasetState(abs_path)
+
+
+def get_dataset_state(file_path=DEFAULT_DATA_FILE):
+    """
+    คืนค่า DatasetState ของไฟล์ หลังจากอ่านแถวที่ต่อท้ายเข้ามาใหม่แล้ว
+    """
+    return _get_state(os.path.abspath(file_path)).refresh()
+
+
+def get_dataset_version(file_path=DEFAULT_DATA_FILE):
+    """
+    คืนค่าเวอร์ชันของชุดข้อมูล (path, lineage, จำนวนแถว) ใช้เป็น key ของ cache ที่สร้างจากข้อมูลนี้
+    """
+    state = get_dataset_state(file_path)
+    return (state.file_path, state.lineage, state.num_rows)
+
+
+def get_lineage(version):
+    """
+    ส่วนของเวอร์ชันที่ไม่เปลี่ยนเมื่อมีแถวต่อท้าย ใช้กับ cache ที่อัปเดตเพิ่มได้
+    """
+    return version[:2]
+
+
+def get_columns(file_path=DEFAULT_DATA_FILE):
+    """
+    คืนค่ารายชื่อคอลัมน์และชนิดข้อมูล (pandas dtype) จาก snapshot โดยไม่โหลดข้อมูล
+    """
+    try:
+        return get_dataset_state(file_path).dtypes
+    except FileNotFoundError:
+        st.error(f"Error: The file '{file_path}' was not found.")
+        return pd.Series(dtype=object)
+    except Exception as e:
+        st.error(f"Error reading data schema: {e}")
+        return pd.Series(dtype=object)
+
+
+def get_numeric_columns(file_path=DEFAULT_DATA_FILE):
+    """
+    คืนค่ารายชื่อคอลัมน์ตัวเลข (ไม่รวม bool) สำหรับใช้ทำกราฟ
+    """
+    return [
+        col for col, dtype in get_columns(file_path).items()
+        if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+    ]
+
+
+def get_compaction_report(file_path=DEFAULT_DATA_FILE):
+    """
+    คืนค่า report ขนาดหน่วยความจำก่อน/หลังการ compact ที่บันทึกไว้ใน snapshot
+    """
+    try:
+        return get_dataset_state(file_path).report
+    except Exception:
+        return None
+
+
+def read_columns(file_path, columns=None, start=0):
+    """
+    อ่านคอลัมน์ที่ต้องการตั้งแต่แถว start โดยไม่เก็บใน cache
+    """
+    return get_dataset_state(file_path).read(columns, start)
+
+
+class FrameCache:
+    """
+    DataFrame ของคอลัมน์ชุดหนึ่งที่ต่อเฉพาะแถวใหม่เมื่อมีแถวต่อท้ายไฟล์ (ไม่อ่าน snapshot ทั้งหมดซ้ำ)
+    """
+    def __init__(self, file_path, columns):
+        self.file_path = file_path
+        self.columns = columns
+        self.frame = None
+        self.lock = threading.Lock()
+
+    def catch_up(self, num_rows):
+        """
+        อ่านแถวตั้งแต่แถวสุดท้ายที่มีอยู่แล้วจนถึง num_rows และต่อท้าย DataFrame เดิม
+        """
+        with self.lock:
+            state = _get_state(self.file_path)
+            if self.frame is None:
+                self.frame = state.read(self.columns)
+            elif len(self.frame) < num_rows:
+                new = state.read(self.columns, start=len(self.frame))
+                self.frame = append_frames(self.frame, new)
+            frame = self.frame
+        # Rows appended after the version was taken belong to the next version
+        return frame.iloc[:num_rows] if len(frame) > num_rows else frame
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _get_frame_cache(file_path, lineage, columns):
+    return FrameCache(file_path, columns)
+
+
+def _load_cached(file_path, lineage, num_rows, columns):
+    """
+    โหลดคอลัมน์ที่ต้องการ แชร์ DataFrame ร่วมกันทุก session และอ่านเฉพาะแถวใหม่เมื่อไฟล์ถูกต่อท้าย
+    """
+    return _get_frame_cache(file_path, lineage, columns).catch_up(num_rows)
+
+
+def get_data_from_csv(file_path=DEFAULT_DATA_FILE, columns=None):
+    """ฟังก์ชันสำหรับโหลดข้อมูลจากไฟล์ CSV (ผ่าน snapshot และ cache ร่วมกันทั้ง process)
+
+    ระบุ columns เพื่อโหลดเฉพาะคอลัมน์ที่ต้องการ
+    DataFrame ที่คืนค่าเป็น object เดียวกันสำหรับทุกหน้า ห้ามแก้ไขในที่ (in-place)
+    """
+    try:
+        version = get_dataset_version(file_path)
+        if columns is not None:
+            columns = tuple(dict.fromkeys(columns))
+        return _load_cached(*version, columns)
+    except FileNotFoundError:
+        st.error(f"Error: The file '{file_path}' was not found.")
+        return pd.DataFrame()
+    except Exception as e:
+        st.error(f"Error loading CSV file: {e}")
+        return pd.DataFrame()
+
+
+if __name__ == "__main__":
+    # Ingestion step: python data_loader.py [merged_data.csv]
+    source = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATA_FILE
+    print(f"Snapshot written: {build_snapshot(source)}")
@@ -0,0 +1,99 @@
+import threading
+
+import pandas as pd
+import streamlit as st
+
+from data_loader import get_lineage, get_numeric_columns, read_columns
+
+# --- Rollup Configuration ---
+AGGREGATIONS = ["sum", "mean", "min", "max", "count"]
+
+
+def _assemble_rollup(parts, value_columns):
+    """
+    รวมผล sum/min/max/count เป็น rollup เดียวและคำนวณ mean จาก sum/count
+    """
+    rollup = pd.concat(parts, axis=1).swaplevel(axis=1)
+    for col in value_columns:
+        count = rollup[(col, "count")]
+        rollup[(col, "mean")] = (rollup[(col, "sum")] / count.where(count > 0)).astype("float64")
+    return rollup.reindex(columns=pd.MultiIndex.from_product([list(value_columns), AGGREGATIONS]))
+
+
+def build_rollup(df, group_columns, value_columns):
+    """
+    คำนวณ sum/mean/min/max/count ของทุกคอลัมน์ตัวเลขในครั้งเดียว
+
+    คืนค่า DataFrame ที่มี index เป็น group_columns และคอลัมน์เป็น (คอลัมน์, aggregation)
+    """
+    grouped = df.groupby(list(group_columns), observed=True, sort=True)[list(value_columns)]
+    # mean is derived from sum/count instead of another pass over the data
+    parts = {agg: getattr(grouped, agg)() for agg in ("sum", "min", "max", "count")}
+    return _assemble_rollup(parts, value_columns)
+
+
+def merge_rollups(left, right):
+    """
+    รวม rollup สองชุด (เช่น ข้อมูลเดิม + แถวที่ต่อท้ายใหม่) โดยไม่ต้องคำนวณจากข้อมูลดิบใหม่
+    """
+    value_columns = list(dict.fromkeys(left.columns.get_level_values(0)))
+    combined = pd.concat([left, right])
+    grouped = combined.groupby(level=list(range(combined.index.nlevels)), observed=True, sort=True)
+    parts = {
+        "sum": grouped.sum().xs("sum", axis=1, level=1),
+        "min": grouped.min().xs("min", axis=1, level=1),
+        "max": grouped.max().xs("max", axis=1, level=1),
+        "count": grouped.sum().xs("count", axis=1, level=1),
+    }
+    return _assemble_rollup(parts, value_columns)
+
+
+class RollupCache:
+    """
+    Rollup ที่อัปเดตเพิ่มได้เมื่อมีแถวต่อท้ายไฟล์ (คำนวณเฉพาะแถวใหม่แล้ว merge)
+    """
+    def __init__(self, file_path, group_columns):
+        self.file_path = file_path
+        self.group_columns = group_columns
+        self.value_columns = [col for col in get_numeric_columns(file_path) if col not in group_columns]
+        self.num_rows = 0
+        self.frame = None
+        self.lock = threading.Lock()
+
+    def catch_up(self, num_rows):
+        """
+        คำนวณ rollup ของแถวตั้งแต่ self.num_rows ถึง num_rows แล้ว merge เข้ากับของเดิม
+        """
+        with self.lock:
+            if self.frame is not None and num_rows <= self.num_rows:
+                return self.frame
+            # Only the wide numeric frame of the new rows is read, and it is not cached
+            df = read_columns(self.file_path, list(self.group_columns) + self.value_columns, start=self.num_rows)
+            df = df.iloc[:num_rows - self.num_rows]
+            rollup = build_rollup(df, self.group_columns, self.value_columns)
+            self.frame = rollup if self.frame is None else merge_rollups(self.frame, rollup)
+            self.num_rows += len(df)
+            return self.frame
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _get_rollup_cache(file_path, lineage, group_columns):
+    return RollupCache(file_path, group_columns)
+
+
+def get_rollup(file_path, version, group_columns):
+    """
+    Rollup ต่อ (snapshot ฐาน, group_columns) แชร์ร่วมกันทุก session และอัปเดตเฉพาะแถวใหม่
+    """
+    cache = _get_rollup_cache(file_path, get_lineage(version), group_columns)
+    return cache.catch_up(version[2])
+
+
+def get_chart_data(rollup, column, aggregation="sum"):
+    """
+    ดึงข้อมูลสำหรับกราฟจาก rollup (group ที่สองจะถูกแยกเป็นคอลัมน์ของกราฟ)
+    """
+    chart_data = rollup[(column, aggregation)].rename(column)
+    if isinstance(chart_data.index, pd.MultiIndex):
+        chart_data = chart_data.unstack(level=list(range(1, chart_data.index.nlevels)))
+    return chart_data
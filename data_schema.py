@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# --- Schema Configuration ---
+TIMESTAMP_COLUMNS = ["MeasureTimestamp", "CreationTimestamp", "ModificationTimestamp", "Timestamp"]
+# Always stored as categoricals, whatever their cardinality
+CATEGORY_COLUMNS = ["Name", "treatment_type", "XUnit", "YUnit"]
+# Kept as float64 even when a smaller type would be lossless
+FLOAT_COLUMNS = ["Value"]
+DISPLAY_TIMEZONE = "Asia/Bangkok"
+# Text columns with at most this share of distinct values become categoricals
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+FLAG_VALUES = {"True": True, "False": False, "true": True, "false": False, True: True, False: False}
+
+
+def memory_usage_bytes(df):
+    """
+    คืนค่าหน่วยความจำที่ DataFrame ใช้ (รวม string ด้วย)
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def format_bytes(num_bytes):
+    """
+    แปลงจำนวน byte เป็นข้อความที่อ่านง่าย
+    """
+    size = float(num_bytes)
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def _is_text(series):
+    return pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)
+
+
+def _as_flag(series):
+    """
+    แปลงคอลัมน์ True/False ที่เป็นข้อความให้เป็น boolean (คืนค่า None ถ้าไม่ใช่ flag)
+    """
+    values = series.dropna().unique()
+    if len(values) == 0 or not all(isinstance(v, (str, bool, np.bool_)) and v in FLAG_VALUES for v in values):
+        return None
+    return series.map(FLAG_VALUES).astype("boolean")
+
+
+def _downcast_numeric(series):
+    """
+    ลดขนาดชนิดข้อมูลตัวเลขเฉพาะกรณีที่ไม่เสียความละเอียด
+    """
+    if pd.api.types.is_bool_dtype(series):
+        return series
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast="integer")
+
+    values = series.to_numpy(dtype="float64", na_value=np.nan)
+    finite = values[~np.isnan(values)]
+    if len(finite) and np.all(np.mod(finite, 1) == 0) and np.abs(finite).max() < 2 ** 31:
+        # Integral floats (ids, counters, enum codes) become nullable integers
+        for dtype in ("Int8", "Int16", "Int32"):
+            info = np.iinfo(dtype.lower())
+            if finite.min() >= info.min and finite.max() <= info.max:
+                return series.astype(dtype)
+    as_float32 = values.astype("float32")
+    if np.array_equal(as_float32.astype("float64"), values, equal_nan=True):
+        return pd.Series(as_float32, index=series.index, name=series.name)
+    return series
+
+
+def parse_timestamps(series, timezone=DISPLAY_TIMEZONE):
+    """
+    แปลงข้อความเวลา (เช่น 2017-05-25 16:37:19+07) เป็น datetime64 แบบมี timezone
+    """
+    return pd.to_datetime(series, errors="coerce", utc=True).dt.tz_convert(timezone)
+
+
+def compact_frame(df, drop_empty=True, category_ratio=CATEGORY_MAX_UNIQUE_RATIO):
+    """
+    ลดการใช้หน่วยความจำของ DataFrame ข้อมูลการวัด
+
+    - ลบคอลัมน์ที่ว่างทั้งคอลัมน์
+    - แปลงคอลัมน์เวลาเป็น datetime64 แบบมี timezone
+    - แปลงคอลัมน์ข้อความที่มีค่าซ้ำมากเป็น category และ flag เป็น boolean
+    - ลดขนาดชนิดข้อมูลตัวเลข
+
+    คืนค่า (DataFrame ใหม่, report) โดย report บอกขนาดหน่วยความจำก่อน/หลัง
+    """
+    report = {
+        "rows": len(df),
+        "memory_before": memory_usage_bytes(df),
+        "dropped_columns": [],
+        "converted": {},
+    }
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if drop_empty and len(series) and series.isna().all():
+            report["dropped_columns"].append(col)
+            continue
+
+        before = str(series.dtype)
+        if col in TIMESTAMP_COLUMNS:
+            series = parse_timestamps(series)
+        elif col in CATEGORY_COLUMNS:
+            series = series.astype("category")
+        elif col in FLOAT_COLUMNS:
+            series = pd.to_numeric(series, errors="coerce").astype("float64")
+        elif _is_text(series):
+            flags = _as_flag(series)
+            if flags is not None:
+                series = flags
+            elif series.nunique(dropna=True) <= max(1, len(series) * category_ratio):
+                series = series.astype("category")
+            else:
+                # Mixed-type object columns cannot be stored in Arrow as-is
+                series = series.astype("string")
+        elif pd.api.types.is_numeric_dtype(series):
+            series = _downcast_numeric(series)
+
+        if str(series.dtype) != before:
+            report["converted"][col] = f"{before} -> {series.dtype}"
+        columns[col] = series
+
+    compacted = pd.DataFrame(columns, index=df.index)
+    report["memory_after"] = memory_usage_bytes(compacted)
+    return compacted, report
+
+
+def describe_report(report):
+    """
+    สรุป report ของ compact_frame เป็นข้อความบรรทัดเดียว
+    """
+    before = report["memory_before"]
+    after = report["memory_after"]
+    saved = (1 - after / before) * 100 if before else 0
+    return (
+        f"{report['rows']:,} rows: {format_bytes(before)} -> {format_bytes(after)} "
+        f"({saved:.0f}% smaller, {len(report['dropped_columns'])} empty columns dropped, "
+        f"{len(report['converted'])} columns converted)"
+    )
+
+
+def conform_frame(df, dtypes):
+    """
+    แปลงชนิดข้อมูลของแถวใหม่ให้ตรงกับ schema เดิม (ใช้กับแถวที่ต่อท้ายไฟล์)
+
+    คอลัมน์ที่ไม่มีใน schema เดิมจะถูกลบออกถ้าว่างทั้งคอลัมน์
+    """
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        dtype = dtypes.get(col)
+        if dtype is None:
+            if not series.isna().all():
+                columns[col] = series
+            continue
+        if isinstance(dtype, pd.DatetimeTZDtype):
+            series = parse_timestamps(series, dtype.tz)
+        elif isinstance(dtype, pd.CategoricalDtype):
+            series = series.astype("category")
+        elif pd.api.types.is_bool_dtype(dtype):
+            flags = _as_flag(series) if _is_text(series) else None
+            series = flags if flags is not None else series
+        elif pd.api.types.is_numeric_dtype(dtype):
+            series = pd.to_numeric(series, errors="coerce")
+            if pd.api.types.is_float_dtype(dtype) and pd.api.types.is_float_dtype(series.dtype):
+                series = series.astype(dtype)
+        elif _is_text(series):
+            series = series.astype("string")
+        columns[col] = series
+    return pd.DataFrame(columns, index=df.index)
+
+
+def append_frames(base, new):
+    """
+    ต่อ DataFrame สองชุดเข้าด้วยกัน โดยรวม categories ของคอลัมน์ category ไว้ (ไม่กลายเป็น object)
+    """
+    if new is None or new.empty:
+        return base
+    if base.empty:
+        return new
+    columns = {}
+    for col in dict.fromkeys(list(base.columns) + list(new.columns)):
+        left = base[col] if col in base.columns else pd.Series(np.nan, index=base.index)
+        right = new[col] if col in new.columns else pd.Series(np.nan, index=new.index)
+        if isinstance(left.dtype, pd.CategoricalDtype) or isinstance(right.dtype, pd.CategoricalDtype):
+            left, right = left.astype("category"), right.astype("category")
+            # An all-empty side is parsed as float NaN; give it the other side's categories so the dtypes match
+            if right.isna().all():
+                right = right.astype(left.dtype)
+            elif left.isna().all():
+                left = left.astype(right.dtype)
+            combined = union_categoricals([left.array, right.array], ignore_order=True)
+            columns[col] = pd.Series(combined, name=col)
+        else:
+            columns[col] = pd.concat([left, right], ignore_index=True)
+    return pd.DataFrame(columns)
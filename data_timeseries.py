@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# --- Trend Configuration ---
+TIME_COLUMN = "MeasureTimestamp"
+VALUE_COLUMN = "Value"
+SERIES_COLUMNS = ["BearingAxisId", "treatment_type"]
+DOWNSAMPLE_METHODS = ["lttb", "minmax"]
+DEFAULT_POINT_BUDGET = 1000
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: เลือก index ของจุดที่คงรูปทรงกราฟไว้ threshold จุด
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # First and last points are always kept; the rest is split into threshold - 2 buckets
+    edges = np.append(np.linspace(1, n - 1, threshold - 1).astype(np.intp), n)
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2]
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y, threshold):
+    """
+    แบ่งข้อมูลเป็น bucket และเก็บจุดต่ำสุด/สูงสุดของแต่ละ bucket (รักษา peak ไว้)
+    """
+    n = len(y)
+    if threshold >= n or threshold < 2:
+        return np.arange(n)
+    buckets = np.arange(n) * (threshold // 2) // n
+    grouped = pd.Series(y).groupby(buckets)
+    return np.unique(np.concatenate([grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy()]))
+
+
+def downsample(x, y, threshold, method="lttb"):
+    """
+    คืนค่า index ของจุดที่ใช้แสดงผล ไม่เกิน threshold จุด
+    """
+    if method == "minmax":
+        return minmax_indices(y, threshold)
+    return lttb_indices(x, y, threshold)
+
+
+def series_label(key, series_columns):
+    """
+    สร้างชื่อเส้นกราฟ เช่น 'BearingAxisId=1, treatment_type=P'
+    """
+    if not series_columns:
+        return VALUE_COLUMN
+    key = key if isinstance(key, tuple) else (key,)
+    return ", ".join(f"{col}={value}" for col, value in zip(series_columns, key))
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def get_trend(version, machine, series_columns, point_budget, method, _df):
+    """
+    ข้อมูล Value ตามเวลาของเครื่องจักรหนึ่งเครื่อง ลดจำนวนจุดฝั่ง server ให้ไม่เกิน point_budget
+
+    คืนค่า DataFrame แบบ long format (MeasureTimestamp, Value, Series)
+    """
+    df = _df[(_df["Name"] == machine).to_numpy(dtype=bool)]
+    df = df[df[TIME_COLUMN].notna() & df[VALUE_COLUMN].notna()]
+    if df.empty:
+        return pd.DataFrame(columns=[TIME_COLUMN, VALUE_COLUMN, "Series"])
+
+    groups = df.groupby(list(series_columns), observed=True, sort=True) if series_columns else [(None, df)]
+    groups = list(groups)
+    # The point budget is shared between all lines of the chart
+    per_series = max(3, point_budget // len(groups))
+
+    parts = []
+    for key, group in groups:
+        group = group.sort_values(TIME_COLUMN, kind="stable")
+        x = group[TIME_COLUMN].to_numpy(dtype="datetime64[ns]").astype("int64").astype("float64")
+        y = group[VALUE_COLUMN].to_numpy(dtype="float64")
+        keep = downsample(x, y, per_series, method)
+        parts.append(pd.DataFrame({
+            TIME_COLUMN: group[TIME_COLUMN].array[keep],
+            VALUE_COLUMN: y[keep],
+            "Series": series_label(key, series_columns),
+        }))
+    return pd.concat(parts, ignore_index=True)
@@ -0,0 +1,124 @@
+import base64
+import hashlib
+import io
+import mmap
+import os
+
+import streamlit as st
+from PIL import Image
+
+from image_utils import flatten_alpha
+
+# --- Configuration ---
+IMAGE_STORE_DIR = os.path.join("chat_history", "images")
+# Thumbnails shown in the chat history (ready-to-send JPEG bytes)
+THUMBNAIL_WIDTH = 300
+THUMBNAIL_FORMAT = "JPEG"
+THUMBNAIL_QUALITY = 85
+THUMBNAIL_CACHE_ENTRIES = 256
+
+
+class ImageStore:
+    """
+    เก็บไฟล์รูปภาพแบบ content-addressed (ชื่อไฟล์คือ sha256 ของข้อมูล) รูปเดียวกันเก็บครั้งเดียว
+
+    ข้อความในประวัติการแชทเก็บเฉพาะ hash และอ่านรูปเมื่อต้องแสดงผลเท่านั้น (memory map)
+    """
+    def __init__(self, root=IMAGE_STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, image_hash):
+        """
+        คืนค่า path ของรูปภาพ (แบ่งโฟลเดอร์ตาม 2 ตัวอักษรแรกของ hash)
+        """
+        return os.path.join(self.root, image_hash[:2], image_hash)
+
+    def put(self, data):
+        """
+        บันทึกรูปภาพ (bytes) คืนค่า hash ถ้ามีรูปนี้อยู่แล้วจะไม่เขียนซ้ำ
+        """
+        image_hash = hashlib.sha256(data).hexdigest()
+        path = self.path(image_hash)
+        if os.path.exists(path):
+            return image_hash
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial image
+        tmp_path = f"{path}.tmp-{os.getpid()}-{id(data)}"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return image_hash
+
+    def put_base64(self, image_base64):
+        """
+        บันทึกรูปภาพจาก base64 string (ใช้กับประวัติการแชทรูปแบบเดิม)
+        """
+        return self.put(base64.b64decode(image_base64))
+
+    def open(self, image_hash):
+        """
+        เปิดรูปภาพแบบ memory map (อ่านแบบ lazy) คืนค่า None ถ้าไม่พบ
+        """
+        try:
+            with open(self.path(image_hash), "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+@st.cache_resource
+def get_image_store(root=IMAGE_STORE_DIR):
+    """
+    ImageStore หนึ่งตัวต่อ process
+    """
+    return ImageStore(root)
+
+
+def externalize_image(message, store=None):
+    """
+    ย้ายรูป base64 ในข้อความ (รูปแบบเดิม) ไปไว้ใน ImageStore และเก็บเฉพาะ hash ในข้อความ
+    """
+    if "image" not in message:
+        return message
+    store = store or get_image_store()
+    message = dict(message)
+    message["image_hash"] = store.put_base64(message.pop("image"))
+    return message
+
+
+def make_thumbnail(data, width=THUMBNAIL_WIDTH, image_format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY):
+    """
+    ย่อรูปภาพให้กว้างไม่เกิน width และเข้ารหัสเป็น JPEG/WebP bytes
+    """
+    image = Image.open(data)
+    # JPEG can be decoded at a reduced scale directly, which skips most of the decoding work
+    image.draft("RGB", (width, width * image.height // max(image.width, 1)))
+    image.thumbnail((width, image.height), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    flatten_alpha(image).save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
+
+@st.cache_resource(show_spinner=False, max_entries=THUMBNAIL_CACHE_ENTRIES)
+def _load_thumbnail(image_hash):
+    """
+    thumbnail ของรูปภาพตาม hash (LRU จำกัดจำนวน) ถอดรหัสรูปต้นฉบับครั้งเดียวต่อ hash
+
+    raise FileNotFoundError ถ้าไม่พบรูป (ไม่ถูก cache จึงหาใหม่ได้เมื่อรูปถูกเขียนทีหลัง)
+    """
+    data = get_image_store().open(image_hash)
+    if data is None:
+        raise FileNotFoundError(f"image {image_hash} not found")
+    with data:
+        return make_thumbnail(data)
+
+
+def get_thumbnail(image_hash):
+    """
+    thumbnail ของรูปภาพตาม hash คืนค่า None ถ้าไม่พบรูปใน store
+    """
+    try:
+        return _load_thumbnail(image_hash)
+    except FileNotFoundError:
+        return None
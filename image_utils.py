@@ -0,0 +1,127 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import streamlit as st
+from PIL import Image
+
+# --- Image Encoding Configuration ---
+# รูปที่ส่งไป n8n ถูกย่อให้ไม่เกินขนาดนี้
+IMAGE_MAX_SIZE = (800, 600)
+# JPEG / WEBP / PNG
+IMAGE_FORMAT = os.environ.get("CHAT_IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.environ.get("CHAT_IMAGE_QUALITY", "80"))
+# ไฟล์ต้นฉบับที่เล็กกว่านี้ (และไม่เกิน IMAGE_MAX_SIZE) ส่งไปตามเดิมโดยไม่ encode ใหม่
+PASSTHROUGH_MAX_BYTES = int(os.environ.get("CHAT_IMAGE_PASSTHROUGH_BYTES", str(300 * 1024)))
+PASSTHROUGH_FORMATS = {"JPEG", "PNG", "WEBP"}
+# "json" = base64 ใน JSON body, "multipart" = ส่งไฟล์แบบ multipart/form-data
+UPLOAD_MODE = os.environ.get("CHAT_IMAGE_UPLOAD", "json").lower()
+# Thread pool ที่ย่อ/encode รูปที่อัปโหลด และจำนวนผลลัพธ์ที่เก็บไว้ (ตาม hash ของไฟล์)
+PREPROCESS_WORKERS = int(os.environ.get("CHAT_IMAGE_WORKERS", "2"))
+PREPROCESS_CACHE_ENTRIES = 32
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif", "BMP": "image/bmp"}
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+
+class EncodedImage(NamedTuple):
+    """
+    รูปภาพที่พร้อมส่ง: bytes, mime type และชื่อไฟล์ (นามสกุลตรงกับรูปแบบที่ encode)
+    """
+    data: bytes
+    mime_type: str
+    filename: str
+
+
+def flatten_alpha(image):
+    """
+    แปลงรูปเป็น RGB (JPEG ไม่มี alpha channel จึงวางรูปโปร่งใสบนพื้นขาว)
+    """
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+def _with_extension(filename, image_format):
+    stem = os.path.splitext(filename or "image")[0]
+    return stem + EXTENSIONS.get(image_format, "." + image_format.lower())
+
+
+def encode_image(data, filename=None, max_size=IMAGE_MAX_SIZE, image_format=IMAGE_FORMAT,
+                 quality=IMAGE_QUALITY, passthrough_bytes=PASSTHROUGH_MAX_BYTES):
+    """
+    เตรียมรูปที่อัปโหลดสำหรับส่งไป n8n คืนค่า EncodedImage
+
+    ถ้าไฟล์ต้นฉบับเล็กพอและเป็น JPEG/PNG/WebP อยู่แล้วจะใช้ bytes เดิม
+    ไม่เช่นนั้นย่อรูปให้ไม่เกิน max_size แล้ว encode เป็น image_format ที่ quality ที่กำหนด
+    """
+    image = Image.open(io.BytesIO(data))
+    fits = image.width <= max_size[0] and image.height <= max_size[1]
+    if image.format in PASSTHROUGH_FORMATS and fits and len(data) <= passthrough_bytes:
+        return EncodedImage(data, MIME_TYPES[image.format], filename or _with_extension(None, image.format))
+
+    if image.format == "JPEG":
+        # JPEG sources can be decoded at a reduced scale, which is much cheaper than a full decode
+        image.draft("RGB", max_size)
+    image.thumbnail(max_size, Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    if image_format == "JPEG":
+        flatten_alpha(image).save(buffer, format="JPEG", quality=quality, optimize=True)
+    elif image_format == "WEBP":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, format=image_format, optimize=True)
+    return EncodedImage(buffer.getvalue(), MIME_TYPES.get(image_format, "application/octet-stream"),
+                        _with_extension(filename, image_format))
+
+
+class ImagePreprocessor:
+    """
+    ย่อ/encode รูปที่อัปโหลดใน thread pool และเก็บผลลัพธ์ตาม hash ของไฟล์
+
+    preview และการส่งรูปเดียวกันจึงใช้งานชิ้นเดียวกัน (รูปถูกถอดรหัสเพียงครั้งเดียว)
+    """
+    def __init__(self, max_workers=PREPROCESS_WORKERS, max_entries=PREPROCESS_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-encode")
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, data, filename=None, **options):
+        """
+        เริ่ม encode รูป (ถ้ายังไม่เคย) คืนค่า Future ของ EncodedImage
+        """
+        key = (hashlib.sha256(data).hexdigest(), filename, tuple(sorted(options.items())))
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                future = self._executor.submit(encode_image, data, filename, **options)
+                self._futures[key] = future
+                while len(self._futures) > self.max_entries:
+                    self._futures.popitem(last=False)
+            else:
+                self._futures.move_to_end(key)
+        return future
+
+    def encode(self, data, filename=None, **options):
+        """
+        คืนค่า EncodedImage (รอผลจาก thread pool ถ้ายังไม่เสร็จ)
+        """
+        return self.submit(data, filename, **options).result()
+
+
+@st.cache_resource
+def get_image_preprocessor():
+    """
+    ImagePreprocessor หนึ่งตัวต่อ process
+    """
+    return ImagePreprocessor()
@@ -0,0 +1,365 @@
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from chat_store import get_chat_store
+from image_utils import UPLOAD_MODE
+
+# --- HTTP Configuration ---
+# จำนวน connection ที่เปิดค้างไว้ต่อ host (ปรับได้ผ่าน environment variable)
+HTTP_POOL_SIZE = int(os.environ.get("N8N_POOL_SIZE", "10"))
+HTTP_RETRIES = int(os.environ.get("N8N_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.environ.get("N8N_BACKOFF_FACTOR", "0.5"))
+# Gateway errors returned before the request reached n8n (ngrok / proxy) are safe to resend
+RETRY_STATUS_CODES = (502, 503, 504)
+
+
+def build_session(pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR):
+    """
+    สร้าง requests.Session ที่มี connection pool (keep-alive) และ retry แบบ backoff
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        # A read error means the webhook may already have run; resending the POST would duplicate it
+        read=0,
+        other=0,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        # The webhook is called with POST, which urllib3 does not retry by default
+        allowed_methods=frozenset({"GET", "POST"}),
+        # Return the last response so callers still see the HTTP error via raise_for_status()
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@st.cache_resource
+def get_http_session(pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR):
+    """
+    Session หนึ่งตัวต่อ process แชร์ connection ที่เปิดไว้แล้วระหว่างทุก session ของผู้ใช้
+    """
+    return build_session(pool_size, retries, backoff_factor)
+
+
+# --- Streaming Responses ---
+# Content types that are read chunk by chunk; anything else is parsed as one JSON reply
+STREAM_CONTENT_TYPES = ("text/event-stream", "application/x-ndjson", "application/jsonl", "text/plain")
+STREAM_DONE = "[DONE]"
+
+
+def content_type(response):
+    return response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+
+
+def is_streaming_response(response):
+    """
+    ตรวจว่า webhook ตอบกลับแบบ stream (SSE / JSON lines / text) หรือเป็น JSON ก้อนเดียว
+    """
+    return content_type(response) in STREAM_CONTENT_TYPES
+
+
+def chunk_text(data):
+    """
+    ดึงข้อความจาก chunk หนึ่งชิ้น (JSON เช่น {"type": "item", "content": "..."} หรือข้อความธรรมดา)
+    """
+    try:
+        chunk = json.loads(data)
+    except json.JSONDecodeError:
+        return data
+    if isinstance(chunk, str):
+        return chunk
+    if not isinstance(chunk, dict) or chunk.get("type") in ("begin", "end"):
+        return ""
+    for key in ("content", "delta", "text", "reply", "output"):
+        if isinstance(chunk.get(key), str):
+            return chunk[key]
+    return ""
+
+
+def iter_reply_chunks(response):
+    """
+    อ่านคำตอบจาก response แบบ stream ทีละส่วน (ReplyJob เก็บแต่ละส่วนไว้ให้หน้าเว็บแสดงผล)
+    """
+    if "charset=" not in response.headers.get("Content-Type", ""):
+        # requests assumes ISO-8859-1 for text/* without a charset; n8n sends UTF-8
+        response.encoding = "utf-8"
+    kind = content_type(response)
+    with response:
+        if kind == "text/event-stream":
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == STREAM_DONE:
+                    break
+                text = chunk_text(data)
+                if text:
+                    yield text
+        elif kind in ("application/x-ndjson", "application/jsonl"):
+            for line in response.iter_lines(decode_unicode=True):
+                text = chunk_text(line) if line.strip() else ""
+                if text:
+                    yield text
+        else:
+            for text in response.iter_content(chunk_size=None, decode_unicode=True):
+                if text:
+                    yield text
+
+
+# --- Background Requests ---
+REQUEST_TIMEOUT = 60
+JOB_WORKERS = int(os.environ.get("N8N_JOB_WORKERS", "8"))
+# Finished jobs nobody collected are dropped after this many seconds
+JOB_RETENTION_SECONDS = 600
+NO_REPLY = "No reply received from n8n."
+# Reply cache for repeated questions (per machine and data version)
+REPLY_CACHE_ENTRIES = int(os.environ.get("N8N_REPLY_CACHE_ENTRIES", "256"))
+REPLY_CACHE_TTL_SECONDS = float(os.environ.get("N8N_REPLY_CACHE_TTL", "300"))
+# ไฟล์ข้อมูลเครื่องจักร (เดียวกับ data_loader.DEFAULT_DATA_FILE) เปลี่ยนเมื่อไรคำตอบที่ cache ไว้ใช้ไม่ได้
+MACHINE_DATA_FILE = "merged_data.csv"
+
+
+def request_reply(session, url, payload, timeout=REQUEST_TIMEOUT, stream=True, on_chunk=None,
+                  image=None, upload_mode=UPLOAD_MODE):
+    """
+    ส่ง payload ไป n8n webhook และคืนค่าข้อความตอบกลับ
+
+    image (EncodedImage) ถูกส่งเป็น base64 ในฟิลด์ "image" หรือเป็นไฟล์ multipart ตาม upload_mode
+    ถ้า webhook ตอบแบบ stream จะเรียก on_chunk ทุกครั้งที่ได้ข้อความเพิ่ม ถ้าเป็น JSON ก้อนเดียวจะอ่าน "reply"
+    """
+    headers = {}
+    if stream:
+        payload = {**payload, "stream": True}
+        headers["Accept"] = "text/event-stream, application/json"
+    if image is not None and upload_mode == "multipart":
+        # Binary upload: no base64 inflation; other fields become form fields
+        fields = {key: value if isinstance(value, str) else json.dumps(value) for key, value in payload.items()}
+        files = {"image": (image.filename, image.data, image.mime_type)}
+        response = session.post(url, data=fields, files=files, headers=headers, timeout=timeout, stream=stream)
+    else:
+        if image is not None:
+            payload = {**payload, "image": base64.b64encode(image.data).decode()}
+        headers["Content-Type"] = "application/json"
+        response = session.post(url, data=json.dumps(payload), headers=headers, timeout=timeout, stream=stream)
+    response.raise_for_status()
+
+    if not is_streaming_response(response):
+        return response.json().get("reply", NO_REPLY)
+    chunks = []
+    for text in iter_reply_chunks(response):
+        chunks.append(text)
+        if on_chunk is not None:
+            on_chunk(text)
+    return "".join(chunks) or NO_REPLY
+
+
+def normalize_message(message):
+    """
+    ทำให้คำถามที่ต่างกันแค่ตัวพิมพ์เล็ก/ใหญ่หรือช่องว่างได้ key เดียวกัน
+    """
+    return " ".join(message.casefold().split())
+
+
+def data_version(file_path=MACHINE_DATA_FILE):
+    """
+    เวอร์ชันของไฟล์ข้อมูลเครื่องจักร (path, mtime, size) คืนค่า None ถ้าไม่มีไฟล์
+    """
+    # Only stat the file: importing data_loader would pull pyarrow into the chat pages
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+
+def reply_cache_key(message, machine_name, version=None, image_hash=None):
+    """
+    key ของ ReplyCache: คำถาม (normalize แล้ว) + เครื่องจักร + เวอร์ชันข้อมูล + hash ของรูป
+    """
+    return (normalize_message(message), machine_name, version, image_hash)
+
+
+class ReplyCache:
+    """
+    เก็บคำตอบของคำถามที่ถามซ้ำ (LRU จำกัดจำนวน และหมดอายุตาม ttl) พร้อมนับ hit/miss
+    """
+    def __init__(self, max_entries=REPLY_CACHE_ENTRIES, ttl=REPLY_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        คืนค่าคำตอบที่ cache ไว้ หรือ None ถ้าไม่มี/หมดอายุแล้ว
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, reply):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        คืนค่า dict ของสถิติ (hits, misses, entries, hit_rate)
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def error_reply(error):
+    """
+    ข้อความที่แสดงในแชทเมื่อเรียก n8n ไม่สำเร็จ
+    """
+    if isinstance(error, requests.exceptions.Timeout):
+        return "Request timed out. Please try again."
+    if isinstance(error, ValueError):
+        # json.JSONDecodeError and requests' own JSONDecodeError are both ValueErrors
+        return "n8n returned an invalid JSON response."
+    return f"Error connecting to n8n: {error}"
+
+
+class ReplyJob:
+    """
+    คำถามหนึ่งข้อที่กำลังรอคำตอบจาก n8n (chunks คือข้อความที่ stream มาแล้ว)
+    """
+    def __init__(self, machine_name):
+        self.id = uuid.uuid4().hex
+        self.machine_name = machine_name
+        self.chunks = []
+        self.message = None
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.message is not None
+
+    @property
+    def partial(self):
+        return "".join(self.chunks)
+
+
+class ReplyJobQueue:
+    """
+    ส่งคำถามไป n8n ใน thread pool เบื้องหลัง หน้าเว็บจึงไม่ต้องรอจนได้คำตอบ
+
+    คำตอบที่ได้จะถูกบันทึกลงประวัติการแชทของเครื่องจักรนั้นทันที หน้าเว็บใช้ job id ตรวจสถานะ
+    """
+    def __init__(self, session, history, cache=None, max_workers=JOB_WORKERS):
+        self.session = session
+        self.history = history
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="n8n-reply")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, machine_name, url, payload, timeout=REQUEST_TIMEOUT, stream=True, cache_key=None, image=None):
+        """
+        ส่งคำถามเข้าคิว คืนค่า job id
+
+        ถ้าระบุ cache_key และมีคำตอบใน cache แล้ว job จะเสร็จทันทีโดยไม่เรียก webhook
+        """
+        job = ReplyJob(machine_name)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        cached = None
+        if self.cache is not None and cache_key is not None:
+            cached = self.cache.get(cache_key)
+        if cached is not None:
+            self._finish(job, cached)
+        else:
+            self._executor.submit(self._run, job, url, payload, timeout, stream, cache_key, image)
+        return job.id
+
+    def _run(self, job, url, payload, timeout, stream, cache_key=None, image=None):
+        try:
+            reply = request_reply(self.session, url, payload, timeout, stream, job.chunks.append, image)
+        except Exception as e:
+            reply = error_reply(e)
+        else:
+            if self.cache is not None and cache_key is not None:
+                self.cache.put(cache_key, reply)
+        self._finish(job, reply)
+
+    def _finish(self, job, reply):
+        message = {"role": "assistant", "content": reply, "job_id": job.id}
+        try:
+            self.history.append(job.machine_name, message)
+        finally:
+            job.finished_at = time.time()
+            job.message = message
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at < cutoff:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pop(self, job_id):
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+
+@st.cache_resource
+def get_reply_cache():
+    """
+    ReplyCache หนึ่งตัวต่อ process (คำถามเดียวกันจากผู้ใช้ต่างคนใช้คำตอบร่วมกัน)
+    """
+    return ReplyCache()
+
+
+@st.cache_resource
+def get_reply_queue():
+    """
+    ReplyJobQueue หนึ่งตัวต่อ process ใช้ HTTP session, history store และ reply cache ร่วมกัน
+    """
+    return ReplyJobQueue(get_http_session(), get_chat_store(), get_reply_cache())
@@ -0,0 +1,199 @@
+import base64
+import binascii
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# --- Spectrum Configuration ---
+SPECTRUM_COLUMNS = ["DataY1", "DataY2"]
+# แกน x ที่บันทึกมากับแต่ละแถว (ถ้าถอดรหัสไม่ได้หรือยาวไม่เท่ากับ DataY จะคำนวณจาก XStartValue/XStep)
+X_COLUMN = "DataX"
+AXIS_COLUMNS = ["XStartValue", "XStep", "XUnit", "YUnit", "WindowType"]
+# Samples are stored as little-endian float32 unless configured otherwise
+BLOB_DTYPE = "<f4"
+PLACEHOLDER_VALUES = {"", "binary data"}
+
+
+def decode_blob(blob, dtype=BLOB_DTYPE):
+    """
+    แปลง blob (bytea hex '\\x...' หรือ base64) เป็น numpy array คืนค่า None ถ้าถอดรหัสไม่ได้
+    """
+    if not isinstance(blob, (str, bytes, bytearray, memoryview)) or blob in PLACEHOLDER_VALUES:
+        return None
+    try:
+        if isinstance(blob, (bytes, bytearray, memoryview)):
+            raw = bytes(blob)
+        elif blob.startswith("\\x"):
+            raw = bytes.fromhex(blob[2:])
+        else:
+            raw = base64.b64decode(blob, validate=True)
+    except (ValueError, binascii.Error):
+        return None
+    itemsize = np.dtype(dtype).itemsize
+    if not raw or len(raw) % itemsize:
+        return None
+    return np.frombuffer(raw, dtype=dtype)
+
+
+class SpectrumSet:
+    """
+    เก็บ spectrum ทั้งหมดใน array เดียวต่อกัน (values) พร้อม offsets แทน list ต่อแถว
+
+    spectrum ที่ i คือ values[offsets[i]:offsets[i + 1]] มาจากแถว rows[i] ของ DataFrame
+    แกน x มาจาก x (เรียงต่อกันเหมือน values) ถ้ามี ไม่เช่นนั้นคำนวณจาก x_start[i] + x_step[i] * k
+    """
+    def __init__(self, values, offsets, rows, x_start, x_step, x=None):
+        self.values = values
+        self.offsets = offsets
+        self.rows = rows
+        self.x_start = x_start
+        self.x_step = x_step
+        self._x = x
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def segment_ids(self):
+        """
+        หมายเลข spectrum ของแต่ละตัวอย่างใน values
+        """
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def x_values(self):
+        """
+        ค่าแกน x ของทุกตัวอย่างใน values (เรียงต่อกันเหมือน values)
+        """
+        if self._x is None:
+            segments = self.segment_ids
+            local = np.arange(len(self.values)) - self.offsets[:-1][segments]
+            self._x = self.x_start[segments] + self.x_step[segments] * local
+        return self._x
+
+    def spectrum(self, i):
+        """
+        คืนค่า (x, y) ของ spectrum ที่ i
+        """
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.x_values()[start:stop], self.values[start:stop]
+
+    def _sum_per_spectrum(self, samples):
+        return np.bincount(self.segment_ids, weights=samples, minlength=len(self))
+
+    def rms(self):
+        """
+        ค่า RMS ของแต่ละ spectrum/waveform: sqrt(mean(y^2))
+        """
+        lengths = self.lengths
+        energy = self._sum_per_spectrum(np.square(self.values, dtype="float64"))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(lengths > 0, np.sqrt(energy / lengths), np.nan)
+
+    def overall(self):
+        """
+        ค่า overall ของ spectrum (ผลรวมพลังงานทุก line): sqrt(sum(y^2))
+        """
+        return np.sqrt(self._sum_per_spectrum(np.square(self.values, dtype="float64")))
+
+    def band_energy(self, low, high):
+        """
+        พลังงานในช่วงความถี่ [low, high] ของทุก spectrum พร้อมกัน: sum(y^2)
+        """
+        x = self.x_values()
+        in_band = (x >= low) & (x <= high)
+        return self._sum_per_spectrum(np.where(in_band, np.square(self.values, dtype="float64"), 0.0))
+
+    def peaks(self, top=5):
+        """
+        หา local maximum สูงสุด top ค่าของแต่ละ spectrum
+
+        คืนค่า DataFrame (spectrum, row, rank, x, amplitude)
+        """
+        y = self.values
+        segments = self.segment_ids
+        if len(y) < 3:
+            return pd.DataFrame(columns=["spectrum", "row", "rank", "x", "amplitude"])
+        # Local maxima that do not cross a spectrum boundary
+        candidate = np.zeros(len(y), dtype=bool)
+        candidate[1:-1] = (y[1:-1] > y[:-2]) & (y[1:-1] >= y[2:])
+        candidate[1:-1] &= (segments[1:-1] == segments[:-2]) & (segments[1:-1] == segments[2:])
+        idx = np.flatnonzero(candidate)
+
+        # Sort by spectrum, then by amplitude (descending) and keep the first `top` of each
+        order = np.lexsort((-y[idx], segments[idx]))
+        idx = idx[order]
+        seg = segments[idx]
+        first = np.searchsorted(seg, seg, side="left")
+        rank = np.arange(len(idx)) - first
+        keep = rank < top
+        idx, seg, rank = idx[keep], seg[keep], rank[keep]
+        return pd.DataFrame({
+            "spectrum": seg,
+            "row": self.rows[seg],
+            "rank": rank + 1,
+            "x": self.x_values()[idx],
+            "amplitude": y[idx],
+        })
+
+
+def _column_or_default(df, column, default):
+    if column in df.columns:
+        return pd.to_numeric(df[column], errors="coerce").fillna(default).to_numpy(dtype="float64")
+    return np.full(len(df), default, dtype="float64")
+
+
+def _decode_column(blobs, dtype):
+    """
+    ถอดรหัส blob ทุกแถวของคอลัมน์ คืนค่า list ของ array (None สำหรับแถวที่ถอดรหัสไม่ได้)
+    """
+    if isinstance(blobs.dtype, pd.CategoricalDtype):
+        # Each distinct blob is decoded once, then reused through the category codes
+        decoded = [decode_blob(blob, dtype) for blob in blobs.cat.categories]
+        codes = blobs.cat.codes.to_numpy()
+        return [decoded[code] if code >= 0 else None for code in codes]
+    return [decode_blob(blob, dtype) for blob in blobs.to_numpy(dtype=object)]
+
+
+def build_spectrum_set(df, column="DataY1", dtype=BLOB_DTYPE):
+    """
+    ถอดรหัส blob ในคอลัมน์ที่เลือกของทุกแถวเป็น SpectrumSet
+
+    ถ้า DataFrame มีคอลัมน์ DataX ที่ถอดรหัสได้และยาวเท่ากับ spectrum จะใช้เป็นแกน x ของแถวนั้น
+    """
+    if column not in df.columns:
+        return SpectrumSet(np.empty(0, dtype=dtype), np.zeros(1, dtype=np.int64),
+                           np.empty(0, dtype=np.intp), np.empty(0), np.empty(0))
+    arrays = _decode_column(df[column], dtype)
+
+    rows = np.array([i for i, arr in enumerate(arrays) if arr is not None], dtype=np.intp)
+    arrays = [arrays[i] for i in rows]
+    lengths = np.array([len(arr) for arr in arrays], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    values = np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+
+    x_start = _column_or_default(df, "XStartValue", 0.0)[rows]
+    x_step = _column_or_default(df, "XStep", 1.0)[rows]
+    spectra = SpectrumSet(values, offsets, rows, x_start, x_step)
+    if X_COLUMN in df.columns and column != X_COLUMN:
+        x_arrays = _decode_column(df[X_COLUMN], dtype)
+        recorded = [i for i, row in enumerate(rows)
+                    if x_arrays[row] is not None and len(x_arrays[row]) == lengths[i]]
+        if recorded:
+            x = spectra.x_values().copy()
+            for i in recorded:
+                x[offsets[i]:offsets[i + 1]] = x_arrays[rows[i]]
+            spectra = SpectrumSet(values, offsets, rows, x_start, x_step, x)
+    return spectra
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_spectrum_set(version, column, _df):
+    """
+    SpectrumSet หนึ่งครั้งต่อ (เวอร์ชันข้อมูล, คอลัมน์) และแชร์ร่วมกันทุก session
+    """
+    return build_spectrum_set(_df, column)
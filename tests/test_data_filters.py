@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_filters  # noqa: E402
+from data_filters import Condition, condition_mask  # noqa: E402
+from data_index import ValueIndex  # noqa: E402
+
+
+def test_filter_with_older_frame_after_shared_index_was_extended(monkeypatch):
+    old = pd.DataFrame({"Name": ["FAN 1", "FAN 2"] * 5})
+    index = ValueIndex(old["Name"])
+
+    def extended_index(version, column, _series):
+        # Another session appends rows between the index lookup and positions()
+        index.extend(pd.Series(["FAN 1", "FAN 2"], name="Name"))
+        return index
+
+    monkeypatch.setattr(data_filters, "get_value_index", extended_index)
+    mask = condition_mask(old, Condition("Name", "isin", ("FAN 1", "FAN 2")), ("merged_data.csv", 0, len(old)))
+    assert index.num_rows == len(old) + 2
+    assert mask.tolist() == [True] * len(old)
@@ -0,0 +1,63 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_loader import DatasetState  # noqa: E402
+from data_schema import append_frames  # noqa: E402
+
+HEADER = "Name,MeasureTimestamp,Value,XUnit,DataX,DataY1,DataY2\n"
+ROW_WITH_DATA = "FAN 1,2024-01-01 00:00:00,1.5,Hz,\\x0000803f,\\x0000803f,\\x00000040\n"
+ROW_WITHOUT_DATA = "FAN 2,2024-01-01 00:01:00,2.5,Hz,,,\n"
+
+
+def test_append_frames_with_all_empty_categorical_tail():
+    base = pd.DataFrame({"DataY1": pd.Series(["a", "b"], dtype="category")})
+    tail = pd.DataFrame({"DataY1": [float("nan")]}, index=[2])
+    combined = append_frames(base, tail)
+    assert isinstance(combined["DataY1"].dtype, pd.CategoricalDtype)
+    assert combined["DataY1"].tolist()[:2] == ["a", "b"]
+    assert combined["DataY1"].isna().tolist() == [False, False, True]
+
+
+def test_append_rows_with_empty_spectrum_columns(tmp_path):
+    csv_path = tmp_path / "merged_data.csv"
+    csv_path.write_text(HEADER + ROW_WITH_DATA * 3)
+    state = DatasetState(str(csv_path)).refresh()
+    assert state.num_rows == 3
+
+    with open(csv_path, "a") as f:
+        f.write(ROW_WITHOUT_DATA * 2)
+    state.refresh()
+    df = state.read()
+    assert len(df) == 5
+    assert df["DataY1"].isna().tolist() == [False] * 3 + [True] * 2
+    assert df["Name"].tolist()[-1] == "FAN 2"
+    assert len(state.read(["DataX", "DataY1", "DataY2"], start=3)) == 2
+
+
+def test_cached_frame_reads_only_appended_rows(tmp_path, monkeypatch):
+    import data_loader
+
+    csv_path = tmp_path / "merged_data.csv"
+    csv_path.write_text(HEADER + ROW_WITH_DATA * 3)
+    columns = ("Name", "Value")
+    first = data_loader.get_data_from_csv(str(csv_path), columns)
+    assert len(first) == 3
+
+    reads = []
+    original_read = data_loader.DatasetState.read
+
+    def tracking_read(self, columns=None, start=0):
+        reads.append(start)
+        return original_read(self, columns, start)
+
+    monkeypatch.setattr(data_loader.DatasetState, "read", tracking_read)
+    with open(csv_path, "a") as f:
+        f.write(ROW_WITHOUT_DATA * 2)
+    second = data_loader.get_data_from_csv(str(csv_path), columns)
+    assert reads == [3]
+    assert second["Name"].tolist() == ["FAN 1"] * 3 + ["FAN 2"] * 2
+    assert second["Value"].tolist() == [1.5] * 3 + [2.5] * 2
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spectra import build_spectrum_set  # noqa: E402
+
+
+def blob(values):
+    return "\\x" + np.asarray(values, dtype="<f4").tobytes().hex()
+
+
+def test_recorded_x_axis_is_used_when_present():
+    df = pd.DataFrame({
+        "DataX": [blob([10, 20, 40]), "binary data", blob([1, 2])],
+        "DataY1": [blob([1, 2, 3]), blob([4, 5]), blob([6, 7, 8])],
+        "XStartValue": [0, 5, 0],
+        "XStep": [1.0, 0.5, 2.0],
+    })
+    spectra = build_spectrum_set(df, "DataY1")
+    # Row 0 uses DataX, row 1 has no DataX and row 2 has a DataX of the wrong length
+    assert spectra.spectrum(0)[0].tolist() == [10, 20, 40]
+    assert spectra.spectrum(1)[0].tolist() == [5.0, 5.5]
+    assert spectra.spectrum(2)[0].tolist() == [0.0, 2.0, 4.0]
+    assert spectra.band_energy(15, 45)[0] == 2 ** 2 + 3 ** 2
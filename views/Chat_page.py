@@ -1,66 +1,89 @@
 import streamlit as st
-import requests
-import json
-import os
 import pandas as pd
 import csv
-import base64
-from PIL import Image
-import io
+
+from chat_store import get_chat_store
+from image_utils import get_image_preprocessor
+from n8n_client import data_version, get_reply_cache, get_reply_queue, reply_cache_key
+from image_store import get_image_store, get_thumbnail
 
 # --- Configuration ---
 # URL ของ n8n webhook
 N8N_WEBHOOK_URL = "https://eminent-wallaby-safely.ngrok-free.app/webhook/d8e551ba-6202-4544-be0a-74294ecff821"
+# จำนวนข้อความที่แสดงต่อหน้า (โหลดข้อความเก่าเพิ่มทีละหน้า)
+HISTORY_PAGE_SIZE = 30
+# ขอคำตอบแบบ stream (SSE/chunked) ถ้า webhook ตอบกลับเป็น JSON ก้อนเดียวจะใช้โหมดเดิมอัตโนมัติ
+STREAM_RESPONSES = True
+# ความถี่ (วินาที) ในการตรวจคำตอบที่ส่งไปประมวลผลเบื้องหลัง
+# คำตอบที่ stream มาจะแสดงเป็นข้อความบางส่วนทุกรอบ (ไม่ใช้ st.write_stream เพราะจะบล็อกหน้าจนตอบเสร็จ)
+REPLY_POLL_SECONDS = 0.5
 
-def load_chat_history(machine_name):
+def load_chat_history(machine_name, start, stop=None):
     """
-    ฟังก์ชันสำหรับโหลดประวัติการแชทจากไฟล์ JSON ตามชื่อโซนและเครื่องจักร
+    ฟังก์ชันสำหรับโหลดประวัติการแชทช่วง [start, stop) จาก store แบบ append-only ตามชื่อเครื่องจักร
     """
-    chat_history_file = f"{machine_name}.json"
-    if os.path.exists(chat_history_file):
-        try:
-            with open(chat_history_file, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
-    return []
+    return get_chat_store().load_range(machine_name, start, stop)
 
-def save_chat_history(machine_name, messages):
+def load_recent_history(machine_name):
     """
-    ฟังก์ชันสำหรับบันทึกประวัติการแชทลงในไฟล์ JSON ตามชื่อโซนและเครื่องจักร
+    โหลดเฉพาะหน้าล่าสุดของประวัติการแชท และจำตำแหน่งข้อความแรกที่โหลดไว้
     """
-    chat_history_file = f"{machine_name}.json"
-    with open(chat_history_file, "w", encoding="utf-8") as f:
-        json.dump(messages, f, indent=4, ensure_ascii=False)
+    total = get_chat_store().count(machine_name)
+    start = max(0, total - HISTORY_PAGE_SIZE)
+    st.session_state.history_start = start
+    st.session_state.messages = load_chat_history(machine_name, start, total)
 
-def image_to_base64(image):
+def load_older_history(machine_name):
     """
-    แปลงรูปภาพเป็น base64 string
+    โหลดข้อความก่อนหน้าอีกหนึ่งหน้า (อ่านย้อนหลังจาก store)
     """
-    try:
-        # แปลง PIL Image เป็น bytes
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        
-        # เข้ารหัสเป็น base64
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
-        return img_base64
-    except Exception as e:
-        st.error(f"Error converting image to base64: {e}")
-        return None
+    stop = st.session_state.history_start
+    start = max(0, stop - HISTORY_PAGE_SIZE)
+    st.session_state.messages = load_chat_history(machine_name, start, stop) + st.session_state.messages
+    st.session_state.history_start = start
+
+def append_chat_message(machine_name, message):
+    """
+    เพิ่มข้อความลงใน session และบันทึกต่อท้ายประวัติการแชท (ไม่เขียนไฟล์ใหม่ทั้งไฟล์)
+    """
+    st.session_state.messages.append(message)
+    get_chat_store().append(machine_name, message)
 
-def resize_image(image, max_size=(800, 600)):
+def collect_finished_replies():
     """
-    ปรับขนาดรูปภาพเพื่อลดขนาดไฟล์
+    นำคำตอบที่ประมวลผลเสร็จแล้วเข้ามาในหน้าแชท (คำตอบถูกบันทึกลง history store ไว้แล้ว)
     """
-    try:
-        # คำนวณขนาดใหม่โดยคงอัตราส่วน
-        image.thumbnail(max_size, Image.Resampling.LANCZOS)
-        return image
-    except Exception as e:
-        st.error(f"Error resizing image: {e}")
-        return image
+    queue = get_reply_queue()
+    for job_id, machine_name in list(st.session_state.pending_jobs.items()):
+        job = queue.get(job_id)
+        if job is not None and not job.done:
+            continue
+        del st.session_state.pending_jobs[job_id]
+        queue.pop(job_id)
+        if job is None or machine_name != st.session_state.get("current_state_key"):
+            # เครื่องอื่นจะโหลดคำตอบจาก store เองเมื่อเปลี่ยนกลับไป
+            continue
+        if not any(message.get("job_id") == job_id for message in st.session_state.messages):
+            st.session_state.messages.append(job.message)
+
+@st.fragment(run_every=REPLY_POLL_SECONDS)
+def show_pending_replies(machine_name):
+    """
+    แสดงคำตอบที่กำลังรอ (หรือกำลัง stream) และ rerun ทั้งหน้าเมื่อมีคำตอบเสร็จ
+
+    ข้อความที่ stream มาแล้วถูกแสดงใหม่ทุก REPLY_POLL_SECONDS แทนการพิมพ์ต่อทีละ chunk
+    """
+    queue = get_reply_queue()
+    jobs = [queue.get(job_id) for job_id in st.session_state.pending_jobs]
+    if any(job is None or job.done for job in jobs):
+        st.rerun()
+    for job in jobs:
+        if job.machine_name == machine_name:
+            with st.chat_message("assistant"):
+                st.markdown(job.partial or "⏳ Waiting for n8n...")
+    waiting_elsewhere = sum(job.machine_name != machine_name for job in jobs)
+    if waiting_elsewhere:
+        st.caption(f"⏳ Waiting for {waiting_elsewhere} reply(s) from other machines")
 
 # --- Streamlit UI ---
 st.set_page_config(page_title="n8n Chatbot with Image Support", layout="centered")
@@ -81,27 +104,43 @@ with st.sidebar:
     st.markdown("---")
     st.info("✨ Now supports text and image messages!")
     st.info("Developed with Streamlit and n8n")
+    cache_stats = get_reply_cache().stats()
+    st.caption(f"Reply cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+               f"({cache_stats['entries']} cached)")
 
 st.title(f"🤖 Chat with {selected_machine}")
 st.write("Type your message or upload an image to analyze!")
 
 # --- Main App Logic ---
 
+if "pending_jobs" not in st.session_state:
+    st.session_state.pending_jobs = {}
+collect_finished_replies()
+
 # Check for a change in machine selection
 current_state_key = (selected_machine)
 if st.session_state.get("current_state_key") != current_state_key:
-    st.session_state.messages = load_chat_history(selected_machine)
+    load_recent_history(selected_machine)
     st.session_state["current_state_key"] = current_state_key
 
+# ข้อความเก่ากว่าหน้าที่แสดงอยู่ยังไม่ถูกโหลด
+if st.session_state.get("history_start", 0) > 0:
+    st.button(
+        f"⬆️ Load older messages ({st.session_state.history_start} more)",
+        on_click=load_older_history,
+        args=(selected_machine,),
+    )
+
 # Display past messages
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         if message.get("type") == "image":
-            # แสดงรูปภาพจาก base64
+            # แสดง thumbnail ที่ cache ไว้ตาม hash (ไม่ต้องถอดรหัสรูปใหม่ทุกครั้ง)
             try:
-                img_data = base64.b64decode(message["image"])
-                image = Image.open(io.BytesIO(img_data))
-                st.image(image, width=300)
+                thumbnail = get_thumbnail(message["image_hash"])
+                if thumbnail is None:
+                    raise FileNotFoundError(f"image {message['image_hash']} not found")
+                st.image(thumbnail, width=300)
                 if message.get("content"):
                     st.markdown(message["content"])
             except Exception as e:
@@ -109,6 +148,9 @@ for message in st.session_state.messages:
         else:
             st.markdown(message["content"])
 
+if st.session_state.pending_jobs:
+    show_pending_replies(selected_machine)
+
 # --- Image Upload Section ---
 st.markdown("---")
 col1, col2 = st.columns([2, 1])
@@ -129,39 +171,37 @@ with col1:
 
 with col2:
     if uploaded_file is not None:
-        # แสดงรูปภาพที่อัปโหลด
-        image = Image.open(uploaded_file)
-        st.image(image, caption="Uploaded Image", width=200)
+        # แสดงไฟล์ต้นฉบับทันที และเริ่มย่อ/encode ใน thread pool (ตอนส่งจะรอผลลัพธ์ชิ้นเดียวกัน)
+        st.image(uploaded_file, caption="Uploaded Image", width=200)
+        get_image_preprocessor().submit(uploaded_file.getvalue(), uploaded_file.name)
 
 # --- User Input and n8n Integration ---
 if prompt := st.chat_input("Say something..."):
     # ตรวจสอบว่ามีการอัปโหลดรูปภาพหรือไม่
     has_image = uploaded_file is not None
+    image_hash = None
+    encoded_image = None
     
     if has_image:
         try:
-            # เตรียมรูปภาพ
-            image = Image.open(uploaded_file)
-            
-            # ปรับขนาดรูปภาพ
-            image = resize_image(image)
-            
-            # แปลงเป็น base64
-            image_base64 = image_to_base64(image)
+            # ย่อและ encode รูปภาพ (JPEG/WebP หรือใช้ไฟล์เดิมถ้าเล็กพออยู่แล้ว)
+            encoded_image = get_image_preprocessor().encode(uploaded_file.getvalue(), uploaded_file.name)
             
-            if image_base64:
+            if encoded_image.data:
+                # เก็บใน image store (ประวัติการแชทเก็บเฉพาะ hash)
+                image_hash = get_image_store().put(encoded_image.data)
                 # Add user message with image to chat history
                 user_message = {
                     "role": "user", 
                     "content": prompt,
                     "type": "image",
-                    "image": image_base64,
+                    "image_hash": image_hash,
                     "filename": uploaded_file.name
                 }
-                st.session_state.messages.append(user_message)
+                append_chat_message(selected_machine, user_message)
                 
                 with st.chat_message("user"):
-                    st.image(image, width=300)
+                    st.image(get_thumbnail(image_hash), width=300)
                     st.markdown(prompt)
                 
                 # Send message with image to n8n webhook
@@ -169,9 +209,8 @@ if prompt := st.chat_input("Say something..."):
                     "message": prompt,
                     "machine": selected_machine,
                     "has_image": True,
-                    "image": image_base64,
-                    "filename": uploaded_file.name,
-                    "image_type": uploaded_file.type
+                    "filename": encoded_image.filename,
+                    "image_type": encoded_image.mime_type
                 }
             else:
                 st.error("Failed to process the uploaded image.")
@@ -182,7 +221,7 @@ if prompt := st.chat_input("Say something..."):
             st.stop()
     else:
         # Text-only message
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        append_chat_message(selected_machine, {"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
         
@@ -193,45 +232,13 @@ if prompt := st.chat_input("Say something..."):
             "has_image": False
         }
 
-    try:
-        # Send request to n8n webhook
-        headers = {"Content-Type": "application/json"}
-        
-        with st.spinner("Sending to n8n..."):
-            response = requests.post(N8N_WEBHOOK_URL, data=json.dumps(payload), headers=headers, timeout=60)
-            response.raise_for_status()
-
-        # Get n8n's response
-        n8n_response_data = response.json()
-        n8n_message = n8n_response_data.get("reply", "No reply received from n8n.")
-
-        # Add n8n's response to chat history
-        st.session_state.messages.append({"role": "assistant", "content": n8n_message})
-        with st.chat_message("assistant"):
-            st.markdown(n8n_message)
+    # ส่งไปประมวลผลเบื้องหลัง หน้าเว็บจะตรวจคำตอบเองโดยไม่ต้องรอ
+    # คำถามเดิมกับเครื่องและข้อมูลชุดเดิมจะได้คำตอบจาก cache ทันที
+    cache_key = reply_cache_key(prompt, selected_machine, data_version(), image_hash)
+    job_id = get_reply_queue().submit(selected_machine, N8N_WEBHOOK_URL, payload,
+                                      stream=STREAM_RESPONSES, cache_key=cache_key, image=encoded_image)
+    st.session_state.pending_jobs[job_id] = selected_machine
 
-    except requests.exceptions.Timeout:
-        error_message = "Request timed out. Please try again."
-        st.error(error_message)
-        st.session_state.messages.append({"role": "assistant", "content": error_message})
-        with st.chat_message("assistant"):
-            st.markdown(error_message)
-    except requests.exceptions.RequestException as e:
-        error_message = f"Error connecting to n8n: {e}"
-        st.error(error_message)
-        st.session_state.messages.append({"role": "assistant", "content": error_message})
-        with st.chat_message("assistant"):
-            st.markdown(error_message)
-    except json.JSONDecodeError:
-        error_message = "n8n returned an invalid JSON response."
-        st.error(error_message)
-        st.session_state.messages.append({"role": "assistant", "content": error_message})
-        with st.chat_message("assistant"):
-            st.markdown(error_message)
-
-    # Save the updated chat history to file
-    save_chat_history(selected_machine, st.session_state.messages)
-    
     # เคลียร์ file uploader โดยการเพิ่ม counter เพื่อเปลี่ยน key
     if 'uploader_counter' not in st.session_state:
         st.session_state.uploader_counter = 0
@@ -244,7 +251,8 @@ st.markdown("---")
 if st.button("🗑️ Clear Chat History", type="secondary"):
     if st.session_state.get("messages"):
         st.session_state.messages = []
-        save_chat_history(selected_machine, [])
+        st.session_state.history_start = 0
+        get_chat_store().clear(selected_machine)
         st.success("Chat history cleared!")
         st.rerun()
 
@@ -1,60 +1,125 @@
 import streamlit as st
 import pandas as pd
-import csv
-
-
-def get_data_from_csv(file_path):
-    """ฟังก์ชันสำหรับโหลดและทำความสะอาดข้อมูลจากไฟล์ CSV"""
-    try:
-        # Load CSV with specified encoding to avoid errors
-        df = pd.read_csv(file_path, on_bad_lines='skip', engine='python', quoting=csv.QUOTE_NONE, quotechar='"' )
-    except FileNotFoundError:
-        st.error(f"Error: The file '{file_path}' was not found.")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Error loading CSV file: {e}")
-        return pd.DataFrame()
-    
-    # Identify and rename duplicate columns to make them unique for filtering
-    cols = pd.Series(df.columns)
-    for dup in df.columns[df.columns.duplicated(keep=False)]:
-        cols[df.columns.get_loc(dup)] = [f"{x}_{i}" if i != 0 else x for i, x in enumerate(cols[df.columns.get_loc(dup)])]
-    df.columns = cols
-    return df
+
+from data_loader import get_columns, get_data_from_csv, get_dataset_version, get_numeric_columns
+from data_rollups import AGGREGATIONS, get_chart_data, get_rollup
+from data_timeseries import (
+    DEFAULT_POINT_BUDGET, DOWNSAMPLE_METHODS, SERIES_COLUMNS, TIME_COLUMN, VALUE_COLUMN,
+    get_trend, lttb_indices
+)
+from spectra import AXIS_COLUMNS, SPECTRUM_COLUMNS, X_COLUMN, get_spectrum_set
+
+BAR_MODE = "Bar chart by Name"
+TREND_MODE = "Trend over time"
+SPECTRUM_MODE = "Spectrum features"
 
 # --- Graph Page Content ---
 st.title("📊 Data Visualization")
 st.write("Welcome to the Data Dashboard!")
 st.info("You can display a graph from your data here.")
 
-# Load and process data
-df = get_data_from_csv('merged_data.csv')
+# Read the column list from the snapshot schema; only the plotted columns are loaded
+column_types = get_columns('merged_data.csv')
 
-if not df.empty:
+if not column_types.empty:
     st.markdown("---")
     st.subheader("Chart Options")
 
     # Allow user to select a column to plot
-    numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+    numeric_cols = get_numeric_columns('merged_data.csv')
     
     # Assume 'name' column exists for the x-axis
-    if 'Name' in df.columns:
+    if 'Name' in column_types.index:
         name_col = 'Name'
     else:
         name_col = None
         st.warning("Column 'name' not found. Cannot plot grouped bar chart.")
 
-    if numeric_cols and name_col:
+    chart_modes = [BAR_MODE]
+    if name_col and {TIME_COLUMN, VALUE_COLUMN} <= set(column_types.index):
+        chart_modes.append(TREND_MODE)
+    spectrum_options = [col for col in SPECTRUM_COLUMNS if col in column_types.index]
+    if spectrum_options:
+        chart_modes.append(SPECTRUM_MODE)
+    chart_mode = st.radio("Chart mode:", chart_modes, horizontal=True)
+
+    if chart_mode == TREND_MODE:
+        # --- Trend of Value over MeasureTimestamp ---
+        series_options = [col for col in SERIES_COLUMNS if col in column_types.index]
+        trend_df = get_data_from_csv('merged_data.csv', columns=[name_col, TIME_COLUMN, VALUE_COLUMN] + series_options)
+        machines = trend_df[name_col].dropna().unique().tolist()
+        machine = st.selectbox("Machine:", machines)
+        series_columns = st.multiselect("Split lines by:", series_options, default=series_options)
+        col1, col2 = st.columns(2)
+        with col1:
+            point_budget = st.slider("Max points per chart:", 100, 5000, DEFAULT_POINT_BUDGET, step=100)
+        with col2:
+            method = st.selectbox("Downsampling:", DOWNSAMPLE_METHODS)
+
+        st.subheader(f"Trend: '{VALUE_COLUMN}' over time for {machine}")
+
+        # Downsampled on the server so the browser only receives point_budget points
+        trend = get_trend(
+            get_dataset_version('merged_data.csv'), machine, tuple(series_columns),
+            point_budget, method, trend_df
+        )
+        if trend.empty:
+            st.info("No measurements with a timestamp for this machine.")
+        else:
+            st.line_chart(trend, x=TIME_COLUMN, y=VALUE_COLUMN, color='Series')
+            st.caption(f"{len(trend):,} points shown")
+    elif chart_mode == SPECTRUM_MODE:
+        # --- Spectrum features from the DataY blobs ---
+        spectrum_column = st.selectbox("Spectrum channel:", spectrum_options)
+        context_columns = [
+            col for col in [name_col, TIME_COLUMN] + SERIES_COLUMNS + AXIS_COLUMNS
+            if col and col in column_types.index
+        ]
+        # DataX (ถ้ามี) ใช้เป็นแกน x ที่บันทึกมาจริงแทนการคำนวณจาก XStartValue/XStep
+        x_columns = [X_COLUMN] if X_COLUMN in column_types.index else []
+        spectrum_df = get_data_from_csv('merged_data.csv', columns=context_columns + [spectrum_column] + x_columns)
+        spectra = get_spectrum_set(get_dataset_version('merged_data.csv'), spectrum_column, spectrum_df)
+
+        if not len(spectra):
+            st.info(f"No decodable spectra in '{spectrum_column}' for this export.")
+        else:
+            col1, col2 = st.columns(2)
+            with col1:
+                band_low = st.number_input("Band from:", value=0.0)
+            with col2:
+                band_high = st.number_input("Band to:", value=1000.0)
+
+            # Features are computed for all spectra at once on the contiguous array
+            features = spectrum_df.iloc[spectra.rows][context_columns].reset_index(drop=True)
+            features['RMS'] = spectra.rms()
+            features['Overall'] = spectra.overall()
+            features['Band energy'] = spectra.band_energy(band_low, band_high)
+            top_peaks = spectra.peaks(top=1).set_index('spectrum')
+            features['Peak x'] = top_peaks['x'].reindex(features.index)
+            features['Peak amplitude'] = top_peaks['amplitude'].reindex(features.index)
+            st.subheader(f"Spectrum features ({len(spectra):,} spectra)")
+            st.dataframe(features)
+
+            selected = st.number_input("Show spectrum #:", min_value=0, max_value=len(spectra) - 1, value=0)
+            x, y = spectra.spectrum(int(selected))
+            keep = lttb_indices(x, y.astype('float64'), DEFAULT_POINT_BUDGET)
+            st.line_chart(pd.DataFrame({'x': x[keep], 'amplitude': y[keep]}), x='x', y='amplitude')
+    elif numeric_cols and name_col:
         selected_column = st.selectbox(
             "Select a numeric column to visualize:",
             numeric_cols
         )
+        aggregation = st.selectbox("Aggregation:", AGGREGATIONS)
+        group_columns = (name_col,)
+        if 'treatment_type' in column_types.index and st.checkbox("Split by treatment_type"):
+            group_columns = (name_col, 'treatment_type')
 
         # --- Data Visualization (Graph) ---
-        st.subheader(f"Bar Chart: '{selected_column}' by '{name_col}'")
+        st.subheader(f"Bar Chart: {aggregation} of '{selected_column}' by '{name_col}'")
         
-        # Group data by name_col and plot the sum of the selected numeric column
-        chart_data = df.groupby(name_col)[selected_column].sum()
+        # Served from the pre-aggregated rollup (all numeric columns, computed once per data version)
+        rollup = get_rollup('merged_data.csv', get_dataset_version('merged_data.csv'), group_columns)
+        chart_data = get_chart_data(rollup, selected_column, aggregation)
         st.bar_chart(chart_data)
     elif not name_col:
         st.warning("Column 'name' not found. Please ensure your data has a 'name' column to use this chart.")
@@ -1,70 +1,148 @@
+import math
+
 import streamlit as st
 import pandas as pd
-import csv
-
-
-def get_data_from_csv(file_path):
-    """ฟังก์ชันสำหรับโหลดและทำความสะอาดข้อมูลจากไฟล์ CSV"""
-    try:
-        # Load CSV with specified encoding to avoid errors
-        df = pd.read_csv(file_path, on_bad_lines='skip', engine='python', quoting=csv.QUOTE_NONE, quotechar='"' )
-    except FileNotFoundError:
-        st.error(f"Error: The file '{file_path}' was not found.")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Error loading CSV file: {e}")
-        return pd.DataFrame()
-    
-    # Identify and rename duplicate columns to make them unique for filtering
-    cols = pd.Series(df.columns)
-    for dup in df.columns[df.columns.duplicated(keep=False)]:
-        cols[df.columns.get_loc(dup)] = [f"{x}_{i}" if i != 0 else x for i, x in enumerate(cols[df.columns.get_loc(dup)])]
-    df.columns = cols
-    return df
+
+from data_filters import (
+    OPERATORS, PAGE_SIZES, TEXT_SEARCH_COLUMNS, Condition, FilterSpec,
+    get_page, operators_for, spec_columns, text_search_spec
+)
+from data_index import ALL_VALUES, get_filter_options, get_value_index
+from data_loader import get_columns, get_compaction_report, get_data_from_csv, get_dataset_version
+from data_schema import describe_report
+
+# Columns shown by default; any other column can be added from the multiselect
+DEFAULT_TABLE_COLUMNS = [
+    'Name', 'treatment_type', 'BearingAxisId', 'Value', 'MeasureTimestamp',
+    'XUnit', 'YUnit', 'Diagnostic', 'Comment'
+]
+
+MAX_CONDITIONS = 5
+NO_SORT = '(none)'
+
+
+def condition_value_input(i, column, op, series, version):
+    """
+    แสดง widget สำหรับใส่ค่าของเงื่อนไข คืนค่า None ถ้ายังไม่ได้กำหนดเงื่อนไข
+    """
+    if op in ('==', 'isin'):
+        value_index = get_value_index(version, column, series)
+        if op == '==':
+            value = st.selectbox('Value', get_filter_options(value_index), key=f'filter_value_{i}')
+            return None if value == ALL_VALUES else value
+        values = st.multiselect('Values', value_index.values, key=f'filter_values_{i}')
+        return tuple(values) or None
+    if op == 'contains':
+        return st.text_input('Text', key=f'filter_text_{i}') or None
+
+    # 'between': date range for timestamps, numeric range otherwise
+    low, high = series.min(), series.max()
+    if pd.isna(low):
+        return None
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        dates = st.date_input('Range', (low.date(), high.date()), key=f'filter_dates_{i}')
+        if len(dates) != 2:
+            return None
+        return (pd.Timestamp(dates[0]), pd.Timestamp(dates[1]) + pd.Timedelta(days=1) - pd.Timedelta(1, 'us'))
+    low_col, high_col = st.columns(2)
+    low = low_col.number_input('From', value=float(low), key=f'filter_low_{i}')
+    high = high_col.number_input('To', value=float(high), key=f'filter_high_{i}')
+    return (low, high)
+
 
 # --- Data Dashboard Page Content ---
 st.title("📅 Data Show")
 st.info("You can display a data table here.")
 
-# Load and process data
-df = get_data_from_csv('merged_data.csv')
+# Read the column list from the snapshot schema; only the needed columns are loaded
+column_types = get_columns('merged_data.csv')
+if column_types.empty:
+    st.stop()
 
-if not df.empty:
-# --- Data Filtering ---
-    st.subheader("Filter Data")
+# Memory saved by the schema compaction (empty columns are dropped from the snapshot)
+report = get_compaction_report('merged_data.csv')
+if report:
+    st.caption(f"💾 {describe_report(report)}")
 
-# ให้ผู้ใช้เลือกคอลัมน์ที่จะฟิลเตอร์
-column_to_filter = st.selectbox(
-    'Select a column to filter:',
-    df.columns.tolist()
-)
+all_columns = column_types.index.tolist()
+default_columns = [col for col in DEFAULT_TABLE_COLUMNS if col in all_columns] or all_columns
 
-# ให้ผู้ใช้เลือกค่าที่จะฟิลเตอร์จากคอลัมน์ที่เลือก
-unique_values = ['All'] + list(df[column_to_filter].unique())
-selected_value = st.selectbox(
-    f'Select value for {column_to_filter}:',
-    unique_values
+# ให้ผู้ใช้เลือกคอลัมน์ที่จะแสดง
+display_columns = st.multiselect(
+    'Columns to display:',
+    all_columns,
+    default=default_columns
 )
 
-# Apply filter to the DataFrame
-filtered_df = df.copy()
-if selected_value != 'All':
-    filtered_df = filtered_df[filtered_df[column_to_filter] == selected_value]
-    
+# --- Data Filtering ---
+st.subheader("Filter Data")
+
+version = get_dataset_version('merged_data.csv')
+
+combine = st.radio('Combine conditions with:', ['AND', 'OR'], horizontal=True)
+num_conditions = st.number_input('Number of conditions:', min_value=0, max_value=MAX_CONDITIONS, value=1)
+
+# ให้ผู้ใช้กำหนดเงื่อนไขแต่ละข้อ (คอลัมน์, operator, ค่า)
+conditions = []
+for i in range(int(num_conditions)):
+    col1, col2, col3 = st.columns([2, 1, 3])
+    with col1:
+        column = st.selectbox('Column', all_columns, key=f'filter_column_{i}')
+    with col2:
+        op = st.selectbox(
+            'Operator',
+            operators_for(column_types[column]),
+            format_func=OPERATORS.get,
+            key=f'filter_op_{i}'
+        )
+    with col3:
+        # Only the condition's own column is loaded to build its value widget
+        series = get_data_from_csv('merged_data.csv', columns=[column])[column]
+        value = condition_value_input(i, column, op, series, version)
+    if value is not None:
+        conditions.append(Condition(column, op, value))
+
+spec = FilterSpec(tuple(conditions), combine.lower())
+
+# ค้นหาข้อความในคอลัมน์ Diagnostic/Comment
+search_columns = [col for col in TEXT_SEARCH_COLUMNS if col in all_columns]
+if search_columns:
+    search_text = st.text_input(f"Search text in {', '.join(search_columns)}:")
+    if search_text:
+        search_spec = text_search_spec(search_text, search_columns)
+        spec = FilterSpec((spec, search_spec), 'and') if spec.conditions else search_spec
+
 st.markdown("---")
 
 st.subheader("Filtered Data")
 
-# --- Handling potential serialization issues ---
-# If the filtered DataFrame is still too large, sample it
-if filtered_df.shape[0] > 100:
-    st.warning(f"DataFrame is too large to display. Showing a sample of 1000 rows.")
-    filtered_df = filtered_df.sample(100)
-    
-# Convert all object dtypes to string to avoid serialization errors
-for col in filtered_df.columns:
-    if filtered_df[col].dtype == 'object':
-        filtered_df[col] = filtered_df[col].astype(str)
-
-# Display the filtered DataFrame as a table
-st.dataframe(filtered_df)
\ No newline at end of file
+# --- Pagination ---
+col1, col2, col3 = st.columns([2, 1, 1])
+with col1:
+    sort_column = st.selectbox('Sort by:', [NO_SORT] + display_columns)
+with col2:
+    ascending = st.radio('Order:', ['Ascending', 'Descending'], horizontal=True) == 'Ascending'
+with col3:
+    page_size = st.selectbox('Rows per page:', PAGE_SIZES, index=1)
+sort_column = None if sort_column == NO_SORT else sort_column
+
+df = get_data_from_csv('merged_data.csv', columns=display_columns + spec_columns(spec))
+
+# Filter and sort positions are memoized; only the visible page is sliced and stringified
+page = st.session_state.get('table_page', 1)
+page_df, total_rows = get_page(df, spec, version, page, page_size, sort_column, ascending)
+num_pages = max(1, math.ceil(total_rows / page_size))
+if page > num_pages:
+    # The filter changed and the old page no longer exists
+    st.session_state.table_page = page = 1
+    page_df, total_rows = get_page(df, spec, version, page, page_size, sort_column, ascending)
+
+st.number_input('Page:', min_value=1, max_value=num_pages, key='table_page')
+start = (page - 1) * page_size
+st.caption(
+    f"Page {page} of {num_pages} - showing rows "
+    f"{min(start + 1, total_rows):,}-{start + len(page_df):,} of {total_rows:,}"
+)
+
+# Display the current page as a table
+st.dataframe(page_df[display_columns])
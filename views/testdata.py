@@ -1,13 +1,25 @@
 import streamlit as st
 import psycopg2
-import pandas as pd
-import os
+import psycopg2.pool
+from psycopg2.extras import RealDictCursor, execute_values
+import atexit
+import logging
+import hashlib
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
 import json
+import csv
 import base64
-from PIL import Image
 import io
-import requests
+import tempfile
+
+from image_utils import get_image_preprocessor
+from n8n_client import get_http_session
+
+logger = logging.getLogger(__name__)
 
 # --- Database Configuration for Streamlit Cloud ---
 class DatabaseConfig:
@@ -23,68 +35,426 @@ class DatabaseConfig:
             self.username = st.secrets["database"]["user"]
             self.password = st.secrets["database"]["password"]
             self.sslmode = st.secrets["database"].get("sslmode", "require")
+            # ขนาดของ connection pool (ใช้ร่วมกันทุก session)
+            # psycopg2 closes returned connections beyond pool_min, so by default every connection stays open
+            self.pool_max = int(st.secrets["database"].get("pool_max", 10))
+            self.pool_min = int(st.secrets["database"].get("pool_min", self.pool_max))
             self.n8n_webhook_url = st.secrets["n8n"]["webhook_url"]
         except Exception as e:
             st.error("❌ Please configure database secrets in Streamlit Cloud dashboard")
             st.info("Required secrets: database.host, database.port, database.dbname, database.user, database.password, n8n.webhook_url")
             st.stop()
 
+# --- Connection Pool Configuration ---
+# เวลารอ connection ว่างสูงสุด (วินาที) ก่อนแจ้งว่า pool เต็ม
+POOL_WAIT_TIMEOUT = 10
+# connection ที่ไม่ได้ใช้นานกว่านี้ (วินาที) จะถูกตรวจด้วย SELECT 1 ก่อนนำไปใช้
+HEALTH_CHECK_INTERVAL = 30
+# จำนวนแถวที่ server-side cursor ดึงมาต่อรอบ
+STREAM_ITERSIZE = 2000
+# app_statistics ที่ buffer ไว้จะถูกเขียนรวดเดียวทุก ๆ กี่วินาที หรือเมื่อครบจำนวนนี้
+ACTIVITY_FLUSH_INTERVAL = 5
+ACTIVITY_FLUSH_SIZE = 100
+# กันไม่ให้ buffer โตไม่จำกัดเมื่อฐานข้อมูลล่ม (ทิ้งรายการเก่าสุด)
+ACTIVITY_BUFFER_LIMIT = 10000
+
+# ไฟล์ export ที่ใหญ่กว่านี้ (bytes) ถูกเขียนลงไฟล์ชั่วคราวแทนการเก็บใน memory
+EXPORT_SPOOL_BYTES = 8 * 1024 * 1024
+# คอลัมน์ของไฟล์ CSV ที่ export (header ถูกเขียนเสมอแม้ไม่มีข้อความ)
+EXPORT_COLUMNS = ("id", "created_at", "session_id", "role", "message_type", "content", "image_hash")
+CHAT_COLUMNS = ("machine_name", "role", "content", "message_type", "image_hash", "session_id", "created_at")
+IMAGE_COLUMNS = ("image_hash", "image_data", "mime_type")
+# จำนวนรูปที่ cache ไว้หลังดึงจากฐานข้อมูล
+IMAGE_CACHE_ENTRIES = 128
+ACTIVITY_COLUMNS = ("machine_name", "action", "user_session", "timestamp")
+
+class ConnectionPool:
+    """
+    Connection pool แบบ thread-safe (ครอบ psycopg2 ThreadedConnectionPool)
+
+    ยืม/คืน connection ผ่าน context manager, ตรวจสุขภาพ connection ที่ว่างนาน
+    และสร้างใหม่อัตโนมัติเมื่อหลุด พร้อมเก็บสถิติเวลารอและความหนาแน่นของ pool
+    """
+    def __init__(self, config, minconn=10, maxconn=10, wait_timeout=POOL_WAIT_TIMEOUT):
+        self.maxconn = maxconn
+        self.wait_timeout = wait_timeout
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn, maxconn,
+            host=config.host,
+            port=config.port,
+            database=config.database,
+            user=config.username,
+            password=config.password,
+            sslmode=config.sslmode,
+            connect_timeout=10
+        )
+        # ThreadedConnectionPool raises instead of waiting when exhausted; the semaphore makes callers queue
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        # The pool opens minconn connections up front; stamp them now so ones that sit idle
+        # for a long time are health-checked on first use (getconn hands out the newest first)
+        opened = time.monotonic()
+        self._last_used = {id(connection): opened for connection in self._pool._pool}
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "timeouts": 0,
+            "reconnects": 0,
+            "in_use": 0,
+            "peak_in_use": 0,
+        }
+
+    def _is_healthy(self, connection):
+        if connection.closed:
+            return False
+        last_used = self._last_used.get(id(connection))
+        if last_used is None:
+            # Not stamped at startup, so getconn() just opened it
+            self._last_used[id(connection)] = time.monotonic()
+            return True
+        if time.monotonic() - last_used < HEALTH_CHECK_INTERVAL:
+            # Recently used connections are trusted without a round trip
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        connection = self._pool.getconn()
+        if not self._is_healthy(connection):
+            # Drop the broken connection; the pool opens a fresh one on the next getconn()
+            self._last_used.pop(id(connection), None)
+            self._pool.putconn(connection, close=True)
+            connection = self._pool.getconn()
+            with self._lock:
+                self._stats["reconnects"] += 1
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """
+        ยืม connection จาก pool (รอได้ไม่เกิน wait_timeout วินาที) และคืนเมื่อจบ block
+
+        ถ้าเกิด exception ใน block จะ rollback ก่อนคืน connection
+        """
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise psycopg2.pool.PoolError(f"no database connection available after {self.wait_timeout}s")
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+            if waited > 0.001:
+                self._stats["waits"] += 1
+            self._stats["in_use"] += 1
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._stats["in_use"])
+
+        connection = None
+        try:
+            connection = self._checkout()
+            yield connection
+        except Exception:
+            if connection is not None and not connection.closed:
+                connection.rollback()
+            raise
+        finally:
+            if connection is not None:
+                if connection.closed:
+                    self._last_used.pop(id(connection), None)
+                else:
+                    self._last_used[id(connection)] = time.monotonic()
+                self._pool.putconn(connection, close=bool(connection.closed))
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    def metrics(self):
+        """
+        คืนค่าสถิติของ pool (จำนวนการยืม, เวลารอเฉลี่ย/สูงสุด, ความหนาแน่น)
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["max_connections"] = self.maxconn
+        stats["saturation"] = stats["in_use"] / self.maxconn
+        stats["avg_wait_seconds"] = stats["wait_seconds"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+def insert_rows(cursor, table, columns, rows, suffix=""):
+    """
+    INSERT หลายแถวด้วยคำสั่งเดียว (execute_values)
+    """
+    if rows:
+        execute_values(cursor, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s {suffix}", rows)
+
+class UnitOfWork:
+    """
+    รวมการเขียนของหนึ่งรอบแชท (ข้อความ + กิจกรรม) แล้วบันทึกใน transaction เดียว
+    """
+    def __init__(self):
+        self.images = {}
+        self.messages = []
+        self.activities = []
+
+    def add_message(self, machine_name, role, content, message_type='text', image_data=None, session_id=None,
+                    mime_type=None):
+        """
+        เพิ่มข้อความ (image_data คือ bytes ของรูป เก็บแยกในตาราง chat_images) คืนค่า image_hash
+        """
+        image_hash = None
+        if image_data:
+            image_hash = hashlib.sha256(image_data).hexdigest()
+            self.images.setdefault(image_hash, (image_hash, psycopg2.Binary(image_data), mime_type))
+        self.messages.append((machine_name, role, content, message_type, image_hash, session_id, datetime.now()))
+        return image_hash
+
+    def log_activity(self, machine_name, action, session_id):
+        self.activities.append((machine_name, action, session_id, datetime.now()))
+
+    def write(self, cursor):
+        # Images first: chat_history.image_hash references chat_images
+        insert_rows(cursor, "chat_images", IMAGE_COLUMNS, list(self.images.values()),
+                    suffix="ON CONFLICT (image_hash) DO NOTHING")
+        insert_rows(cursor, "chat_history", CHAT_COLUMNS, self.messages)
+        insert_rows(cursor, "app_statistics", ACTIVITY_COLUMNS, self.activities)
+
+class ActivityBuffer:
+    """
+    เก็บ app_statistics ไว้ในหน่วยความจำ แล้วเขียนลงฐานข้อมูลรวดเดียวจาก thread เบื้องหลัง
+
+    ถ้าเขียนไม่สำเร็จ รายการจะถูกเก็บไว้เขียนรอบถัดไป (pending / last_error บอกสถานะ)
+    """
+    def __init__(self, pool, interval=ACTIVITY_FLUSH_INTERVAL, flush_size=ACTIVITY_FLUSH_SIZE):
+        self.pool = pool
+        self.interval = interval
+        self.flush_size = flush_size
+        self.last_error = None
+        self._events = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="activity-flush", daemon=True)
+        self._thread.start()
+        # Write whatever is still buffered when the process shuts down
+        atexit.register(self.close)
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._events)
+
+    def add(self, machine_name, action, session_id):
+        with self._lock:
+            self._events.append((machine_name, action, session_id, datetime.now()))
+            del self._events[:-ACTIVITY_BUFFER_LIMIT]
+            if len(self._events) >= self.flush_size:
+                self._wakeup.set()
+
+    def flush(self):
+        """
+        เขียนกิจกรรมที่ค้างอยู่ทั้งหมดใน transaction เดียว คืนค่าจำนวนแถวที่เขียน
+        """
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+        try:
+            with self.pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    insert_rows(cursor, "app_statistics", ACTIVITY_COLUMNS, events)
+                connection.commit()
+        except Exception as e:
+            # Keep the events for the next attempt
+            with self._lock:
+                self._events[:0] = events
+                del self._events[:-ACTIVITY_BUFFER_LIMIT]
+            self.last_error = e
+            raise
+        self.last_error = None
+        return len(events)
+
+    def close(self):
+        """
+        หยุด thread เบื้องหลังและเขียนกิจกรรมที่ค้างอยู่เป็นครั้งสุดท้าย
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join(timeout=self.interval)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning("Dropped %d activity events on shutdown: %s", self.pending, e)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Activity flush failed, %d events kept for retry: %s", self.pending, e)
+
 class DatabaseManager:
     """
     คลาสสำหรับจัดการการเชื่อมต่อและการทำงานกับ PostgreSQL
     """
     def __init__(self):
         self.config = DatabaseConfig()
-        self.connection = None
     
     @st.cache_resource
-    def get_connection(_self):
+    def _create_pool(_self):
         """
-        สร้างการเชื่อมต่อแบบ cached สำหรับ Streamlit Cloud
+        สร้าง connection pool แบบ cached (หนึ่ง pool ต่อ process ใช้ร่วมกันทุก session)
+
+        ถ้าเชื่อมต่อไม่ได้จะ raise (ไม่ถูก cache) จึงลองเชื่อมต่อใหม่ในการเรียกครั้งถัดไป
+        """
+        return ConnectionPool(_self.config, _self.config.pool_min, _self.config.pool_max)
+    
+    def get_pool(self):
+        """
+        คืนค่า connection pool หรือ None ถ้าฐานข้อมูลยังเชื่อมต่อไม่ได้
         """
         try:
-            connection = psycopg2.connect(
-                host=_self.config.host,
-                port=_self.config.port,
-                database=_self.config.database,
-                user=_self.config.username,
-                password=_self.config.password,
-                sslmode=_self.config.sslmode,
-                connect_timeout=10
-            )
-            return connection
+            return self._create_pool()
         except Exception as e:
             st.error(f"❌ Database connection failed: {e}")
             return None
     
-    def execute_query(self, query, params=None, fetch=True):
+    @st.cache_resource
+    def get_activity_buffer(_self):
         """
-        Execute SQL query อย่างปลอดภัย
+        ActivityBuffer หนึ่งตัวต่อ process (ใช้ pool เดียวกับ query อื่น)
+        """
+        return ActivityBuffer(_self._create_pool())
+    
+    @contextmanager
+    def unit_of_work(self):
         """
-        connection = self.get_connection()
-        if not connection:
+        รวมการเขียนหลายรายการเป็น transaction เดียว
+
+        with db_manager.unit_of_work() as work:
+            work.add_message(...)
+            work.log_activity(...)
+        """
+        work = UnitOfWork()
+        yield work
+        self.commit_work(work)
+    
+    def commit_work(self, work):
+        """
+        บันทึก UnitOfWork ด้วย multi-row INSERT และ commit ครั้งเดียว
+        """
+        pool = self.get_pool()
+        if not pool:
+            return False
+        try:
+            with pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    work.write(cursor)
+                connection.commit()
+            return True
+        except Exception as e:
+            st.error(f"❌ Query execution failed: {e}")
+            return False
+    
+    def test_connection(self):
+        """
+        ตรวจว่ายืม connection จาก pool และรัน query ได้หรือไม่
+        """
+        pool = self.get_pool()
+        if not pool:
+            return False
+        try:
+            with pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+    
+    def execute_query(self, query, params=None):
+        """
+        Execute SQL query (INSERT/UPDATE/DELETE/DDL) อย่างปลอดภัย คืนค่าจำนวนแถวที่ได้รับผล
+
+        SELECT ใช้ fetch_records หรือ iter_query
+        """
+        pool = self.get_pool()
+        if not pool:
             return None
         
         try:
-            with connection.cursor() as cursor:
-                cursor.execute(query, params)
-                
-                if fetch and query.strip().lower().startswith('select'):
-                    columns = [desc[0] for desc in cursor.description]
-                    rows = cursor.fetchall()
-                    return pd.DataFrame(rows, columns=columns)
-                else:
+            with pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(query, params)
                     connection.commit()
                     return cursor.rowcount
                     
         except Exception as e:
             st.error(f"❌ Query execution failed: {e}")
-            connection.rollback()
             return None
     
-    def init_database(self):
+    def fetch_records(self, query, params=None):
         """
-        สร้างตารางที่จำเป็นสำหรับแอปพลิเคชัน
+        รัน SELECT แล้วคืนค่าเป็น list ของ dict (ไม่ผ่าน pandas)
+        """
+        pool = self.get_pool()
+        if not pool:
+            return None
+        
+        try:
+            with pool.connection() as connection:
+                with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute(query, params)
+                    rows = cursor.fetchall()
+                connection.rollback()
+                return rows
+        except Exception as e:
+            st.error(f"❌ Query execution failed: {e}")
+            return None
+    
+    def iter_query(self, query, params=None, itersize=STREAM_ITERSIZE):
+        """
+        รัน SELECT ด้วย named (server-side) cursor และ yield ทีละแถวเป็น dict
+
+        ฐานข้อมูลส่งผลลัพธ์มาทีละ itersize แถว ผลลัพธ์ขนาดใหญ่จึงไม่ต้องอยู่ในหน่วยความจำทั้งหมด
+        connection ถูกยืมจาก pool จนกว่าจะอ่านครบหรือปิด generator
+        """
+        pool = self.get_pool()
+        if not pool:
+            return
+        
+        try:
+            with pool.connection() as connection:
+                try:
+                    with connection.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor) as cursor:
+                        cursor.itersize = itersize
+                        cursor.execute(query, params)
+                        yield from cursor
+                finally:
+                    # A named cursor lives inside a transaction; end it before returning the connection
+                    if not connection.closed:
+                        connection.rollback()
+        except Exception as e:
+            st.error(f"❌ Query execution failed: {e}")
+    
+    @st.cache_resource
+    def _init_database(_self):
+        """
+        สร้างตารางและย้ายข้อมูลรูปเดิม ครั้งเดียวต่อ process (ไม่ใช่ทุก session)
+
+        ถ้าไม่สำเร็จจะ raise (ไม่ถูก cache) จึงลองใหม่ในการเรียกครั้งถัดไป
         """
         create_tables_query = """
         CREATE TABLE IF NOT EXISTS chat_history (
@@ -101,6 +471,19 @@ class DatabaseManager:
         CREATE INDEX IF NOT EXISTS idx_chat_machine_name ON chat_history(machine_name);
         CREATE INDEX IF NOT EXISTS idx_chat_created_at ON chat_history(created_at);
         CREATE INDEX IF NOT EXISTS idx_chat_session_id ON chat_history(session_id);
+        -- keyset pagination ของประวัติการแชท (ต่อ session และทั้งเครื่องจักร)
+        CREATE INDEX IF NOT EXISTS idx_chat_machine_session_created
+            ON chat_history(machine_name, session_id, created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_chat_machine_created
+            ON chat_history(machine_name, created_at, id);
+        
+        -- รูปภาพเก็บแยก (bytea) อ้างอิงด้วย sha256 ประวัติการแชทดึงเฉพาะ hash
+        CREATE TABLE IF NOT EXISTS chat_images (
+            image_hash CHAR(64) PRIMARY KEY,
+            image_data BYTEA NOT NULL,
+            mime_type VARCHAR(50),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
         
         CREATE TABLE IF NOT EXISTS app_statistics (
             id SERIAL PRIMARY KEY,
@@ -110,45 +493,114 @@ class DatabaseManager:
             user_session VARCHAR(100)
         );
         """
-        return self.execute_query(create_tables_query, fetch=False)
+        if _self.execute_query(create_tables_query) is None:
+            raise RuntimeError("creating tables failed")
+        
+        # ALTER TABLE ใช้ ACCESS EXCLUSIVE lock แม้คอลัมน์มีอยู่แล้ว จึงรันเฉพาะตอนที่ยังไม่มี image_hash
+        columns = _self.fetch_records(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = 'chat_history' AND column_name = 'image_hash'"
+        )
+        if columns is None:
+            raise RuntimeError("reading the chat_history columns failed")
+        if not columns:
+            migrate_images_query = """
+            ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS image_hash CHAR(64) REFERENCES chat_images(image_hash);
+        
+            -- ย้ายรูป base64 เดิมในคอลัมน์ image_data ไปตาราง chat_images
+            INSERT INTO chat_images (image_hash, image_data)
+            SELECT DISTINCT encode(sha256(decode(image_data, 'base64')), 'hex'), decode(image_data, 'base64')
+            FROM chat_history
+            WHERE image_data IS NOT NULL AND image_data <> ''
+            ON CONFLICT (image_hash) DO NOTHING;
+        
+            UPDATE chat_history
+            SET image_hash = encode(sha256(decode(image_data, 'base64')), 'hex'), image_data = NULL
+            WHERE image_data IS NOT NULL AND image_data <> '';
+            """
+            if _self.execute_query(migrate_images_query) is None:
+                raise RuntimeError("migrating chat images failed")
+        return True
     
-    def insert_chat_message(self, machine_name, role, content, message_type='text', image_data=None, session_id=None):
-        """
-        บันทึกข้อความแชทลงในฐานข้อมูล
+    def init_database(self):
         """
-        query = """
-        INSERT INTO chat_history (machine_name, role, content, message_type, image_data, session_id, created_at)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        RETURNING id
+        สร้างตารางที่จำเป็นสำหรับแอปพลิเคชัน คืนค่า None ถ้ายังทำไม่สำเร็จ
         """
-        params = (machine_name, role, content, message_type, image_data, session_id, datetime.now())
-        result = self.execute_query(query, params, fetch=True)
-        return result is not None
+        try:
+            return self._init_database()
+        except RuntimeError:
+            # execute_query / fetch_records already reported the error
+            return None
     
-    def get_chat_history(self, machine_name, session_id=None, limit=100):
+    def get_chat_history(self, machine_name, session_id=None, limit=100, before=None):
         """
-        ดึงประวัติการแชทจากฐานข้อมูล
+        ดึงประวัติการแชทจากฐานข้อมูล (limit ข้อความล่าสุด เรียงจากเก่าไปใหม่) เป็น list ของ dict
+
+        before คือ (created_at, id) ของข้อความเก่าสุดที่โหลดไว้แล้ว ใช้โหลดหน้าก่อนหน้าแบบ keyset
+        (เงื่อนไข (created_at, id) < before ใช้ index ได้ตรง ๆ ไม่ต้อง OFFSET)
         """
+        conditions = ["machine_name = %s"]
+        params = [machine_name]
         if session_id:
-            query = """
-            SELECT role, content, message_type, image_data, created_at
-            FROM chat_history 
-            WHERE machine_name = %s AND session_id = %s
-            ORDER BY created_at ASC
-            LIMIT %s
-            """
-            params = (machine_name, session_id, limit)
-        else:
-            query = """
-            SELECT role, content, message_type, image_data, created_at
+            conditions.append("session_id = %s")
+            params.append(session_id)
+        if before is not None:
+            conditions.append("(created_at, id) < (%s, %s)")
+            params.extend(before)
+        params.append(limit)
+        
+        query = f"""
+        SELECT * FROM (
+            SELECT id, role, content, message_type, image_hash IS NOT NULL AS has_image, image_hash, created_at
             FROM chat_history 
-            WHERE machine_name = %s 
-            ORDER BY created_at DESC
+            WHERE {' AND '.join(conditions)}
+            ORDER BY created_at DESC, id DESC
             LIMIT %s
-            """
-            params = (machine_name, limit)
-        
-        return self.execute_query(query, params)
+        ) AS page
+        ORDER BY created_at ASC, id ASC
+        """
+        return self.fetch_records(query, tuple(params))
+    
+    @st.cache_data(max_entries=IMAGE_CACHE_ENTRIES, show_spinner=False)
+    def _fetch_image(_self, image_hash):
+        """
+        ดึง bytes ของรูปตาม hash (cache ไว้ เพราะรูปตาม hash ไม่เปลี่ยน)
+
+        ถ้าไม่พบรูปหรือ query ไม่สำเร็จจะ raise จึงไม่ถูก cache และดึงใหม่ได้ในรอบถัดไป
+        """
+        pool = _self._create_pool()
+        with pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT image_data FROM chat_images WHERE image_hash = %s", (image_hash,))
+                row = cursor.fetchone()
+            connection.rollback()
+        if row is None:
+            raise LookupError(f"image {image_hash} not found")
+        return bytes(row[0])
+    
+    def get_image(self, image_hash):
+        """
+        ดึง bytes ของรูปตาม hash เมื่อต้องแสดงผลเท่านั้น คืนค่า None ถ้าไม่พบ
+        """
+        try:
+            return self._fetch_image(image_hash)
+        except LookupError:
+            return None
+        except Exception as e:
+            st.error(f"❌ Query execution failed: {e}")
+            return None
+    
+    def iter_chat_history(self, machine_name, session_id=None):
+        """
+        อ่านประวัติการแชททั้งหมดของเครื่องจักรแบบ stream (สำหรับ export) เรียงจากเก่าไปใหม่
+        """
+        query = f"""
+        SELECT {', '.join(EXPORT_COLUMNS)}
+        FROM chat_history
+        WHERE machine_name = %s AND (%s IS NULL OR session_id = %s)
+        ORDER BY created_at ASC, id ASC
+        """
+        return self.iter_query(query, (machine_name, session_id, session_id))
     
     def clear_chat_history(self, machine_name, session_id=None):
         """
@@ -161,7 +613,7 @@ class DatabaseManager:
             query = "DELETE FROM chat_history WHERE machine_name = %s"
             params = (machine_name,)
         
-        return self.execute_query(query, params, fetch=False)
+        return self.execute_query(query, params)
     
     def get_statistics(self):
         """
@@ -177,19 +629,78 @@ class DatabaseManager:
         GROUP BY machine_name
         ORDER BY total_messages DESC
         """
-        return self.execute_query(query)
+        return self.fetch_records(query)
     
-    def log_activity(self, machine_name, action, session_id):
+    def log_activity(self, machine_name, action, session_id, buffered=False):
         """
-        บันทึกกิจกรรมการใช้งาน
+        บันทึกกิจกรรมการใช้งาน (buffered=True จะเขียนรวมกันแบบ async โดย ActivityBuffer)
         """
+        buffer = None
+        if buffered:
+            try:
+                buffer = self.get_activity_buffer()
+            except Exception:
+                # Database unavailable: fall back to the direct insert, which reports the error
+                buffer = None
+        if buffer is not None:
+            buffer.add(machine_name, action, session_id)
+            return True
         query = """
         INSERT INTO app_statistics (machine_name, action, user_session)
         VALUES (%s, %s, %s)
         """
-        return self.execute_query(query, (machine_name, action, session_id), fetch=False)
+        return self.execute_query(query, (machine_name, action, session_id))
 
 # --- Helper Functions ---
+# จำนวนข้อความที่โหลดต่อหน้า
+HISTORY_PAGE_SIZE = 100
+
+def rows_to_messages(rows):
+    """
+    แปลงแถว (dict) จาก get_chat_history เป็น list ของ message dict
+    """
+    messages = [
+        {"role": row['role'], "content": row['content'], "type": row['message_type']}
+        for row in rows
+    ]
+    for message, row in zip(messages, rows):
+        if row['has_image']:
+            # เก็บเฉพาะ hash รูปจะถูกดึงจากฐานข้อมูลตอนแสดงผล
+            message["image_hash"] = row['image_hash']
+    return messages
+
+def export_history_csv(db_manager, machine_name, session_id=None):
+    """
+    สร้างไฟล์ CSV ของประวัติการแชท โดยเขียนทีละแถวจาก server-side cursor ลงไฟล์ชั่วคราว (ไม่สร้าง DataFrame)
+
+    ใช้เป็น data ของ st.download_button แบบ callable จึงทำงานเฉพาะตอนกดดาวน์โหลด
+    """
+    # Small exports stay in memory; larger ones roll over to a temporary file on disk
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, mode="w+b")
+    text = io.TextIOWrapper(spool, encoding="utf-8", newline="")
+    writer = csv.DictWriter(text, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for row in db_manager.iter_chat_history(machine_name, session_id):
+        writer.writerow(row)
+    text.detach()
+    spool.seek(0)
+    # st.download_button reads binary files as io.BufferedReader
+    return io.BufferedReader(spool)
+
+def load_history_page(db_manager, machine_name, session_id, before=None):
+    """
+    โหลดประวัติหนึ่งหน้า จำตำแหน่ง keyset ของข้อความเก่าสุด และคืนค่า list ของ message
+    """
+    rows = db_manager.get_chat_history(machine_name, session_id, HISTORY_PAGE_SIZE, before)
+    if not rows:
+        st.session_state.history_before = None
+        return []
+    st.session_state.history_before = (rows[0]['created_at'], rows[0]['id'])
+    # หน้าที่ได้ไม่เต็มแปลว่าไม่มีข้อความเก่ากว่านี้แล้ว
+    if len(rows) < HISTORY_PAGE_SIZE:
+        st.session_state.history_before = None
+    return rows_to_messages(rows)
+
 def get_session_id():
     """
     สร้าง session ID สำหรับผู้ใช้แต่ละคน
@@ -199,15 +710,12 @@ def get_session_id():
         st.session_state.session_id = str(uuid.uuid4())
     return st.session_state.session_id
 
-def image_to_base64(image):
+def prepare_image(data, filename=None):
     """
-    แปลงรูปภาพเป็น base64
+    ย่อและ encode รูปที่อัปโหลด (ดู image_utils.encode_image) คืนค่า EncodedImage
     """
     try:
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        return base64.b64encode(img_buffer.getvalue()).decode()
+        return get_image_preprocessor().encode(data, filename)
     except Exception as e:
         st.error(f"Error converting image: {e}")
         return None
@@ -230,7 +738,7 @@ def send_to_n8n(message, machine_name, has_image=False, image_data=None):
         db_config = DatabaseConfig()
         headers = {"Content-Type": "application/json"}
         
-        response = requests.post(
+        response = get_http_session().post(
             db_config.n8n_webhook_url, 
             data=json.dumps(payload), 
             headers=headers,
@@ -256,8 +764,9 @@ def main():
     # Initialize database
     if 'db_manager' not in st.session_state:
         st.session_state.db_manager = DatabaseManager()
-        # สร้างตารางถ้ายังไม่มี
-        st.session_state.db_manager.init_database()
+    if not st.session_state.get("db_initialized"):
+        # สร้างตารางถ้ายังไม่มี (ทำจริงครั้งเดียวต่อ process ลองใหม่ในรอบถัดไปถ้าฐานข้อมูลยังเชื่อมต่อไม่ได้)
+        st.session_state.db_initialized = st.session_state.db_manager.init_database() is not None
     
     db_manager = st.session_state.db_manager
     session_id = get_session_id()
@@ -270,20 +779,30 @@ def main():
         # Database connection status
         with st.expander("📊 System Status"):
             if st.button("Test Database Connection"):
-                connection = db_manager.get_connection()
-                if connection:
+                # ยืม connection จาก pool แล้วคืน (ไม่ปิด connection ที่ session อื่นใช้อยู่)
+                if db_manager.test_connection():
                     st.success("✅ Database Connected")
-                    try:
-                        connection.close()
-                    except:
-                        pass
+                    pool_stats = db_manager.get_pool().metrics()
+                    st.caption(
+                        f"Pool: {pool_stats['in_use']}/{pool_stats['max_connections']} in use "
+                        f"(peak {pool_stats['peak_in_use']}), "
+                        f"avg wait {pool_stats['avg_wait_seconds'] * 1000:.1f} ms, "
+                        f"max wait {pool_stats['max_wait_seconds'] * 1000:.1f} ms, "
+                        f"{pool_stats['timeouts']} timeouts, {pool_stats['reconnects']} reconnects"
+                    )
+                    activity_buffer = db_manager.get_activity_buffer()
+                    if activity_buffer.last_error is not None:
+                        st.warning(
+                            f"⚠️ Activity log write failed, {activity_buffer.pending} events waiting "
+                            f"for retry: {activity_buffer.last_error}"
+                        )
                 else:
                     st.error("❌ Database Connection Failed")
             
             # Show statistics
             if st.button("Show Usage Statistics"):
                 stats = db_manager.get_statistics()
-                if stats is not None and not stats.empty:
+                if stats:
                     st.dataframe(stats, use_container_width=True)
                 else:
                     st.info("No data available")
@@ -309,12 +828,22 @@ def main():
             if db_manager.clear_chat_history(selected_machine, session_id):
                 st.success("Session cleared!")
                 st.session_state.messages = []
+                st.session_state.history_before = None
                 st.rerun()
         
+        st.download_button(
+            "📥 Download Session History",
+            lambda: export_history_csv(db_manager, selected_machine, session_id),
+            file_name=f"{selected_machine}_{session_id[:8]}_chat_history.csv",
+            mime="text/csv",
+            on_click="ignore"
+        )
+        
         if st.button("🗂️ Clear All History"):
             if db_manager.clear_chat_history(selected_machine):
                 st.success("All history cleared!")
                 st.session_state.messages = []
+                st.session_state.history_before = None
                 st.rerun()
         
         st.markdown("---")
@@ -328,33 +857,28 @@ def main():
     # Load chat history
     if st.session_state.get("current_machine") != selected_machine:
         # Log machine change
-        db_manager.log_activity(selected_machine, "machine_selected", session_id)
+        db_manager.log_activity(selected_machine, "machine_selected", session_id, buffered=True)
         
         # Load chat history for this session
-        chat_df = db_manager.get_chat_history(selected_machine, session_id)
-        st.session_state.messages = []
-        
-        if chat_df is not None and not chat_df.empty:
-            for _, row in chat_df.iterrows():
-                message = {
-                    "role": row['role'],
-                    "content": row['content'],
-                    "type": row['message_type']
-                }
-                if row['image_data']:
-                    message["image"] = row['image_data']
-                st.session_state.messages.append(message)
-        
+        st.session_state.messages = load_history_page(db_manager, selected_machine, session_id)
         st.session_state.current_machine = selected_machine
     
+    # Load the previous page (keyset: messages older than the oldest one shown)
+    if st.session_state.get("history_before") is not None:
+        if st.button("⬆️ Load older messages"):
+            older = load_history_page(db_manager, selected_machine, session_id, st.session_state.history_before)
+            st.session_state.messages = older + st.session_state.messages
+            st.rerun()
+    
     # Display chat messages
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
-            if message.get("type") == "image" and message.get("image"):
+            if message.get("type") == "image" and message.get("image_hash"):
                 try:
-                    img_data = base64.b64decode(message["image"])
-                    image = Image.open(io.BytesIO(img_data))
-                    st.image(image, width=300)
+                    img_data = db_manager.get_image(message["image_hash"])
+                    if img_data is None:
+                        raise FileNotFoundError(f"image {message['image_hash']} not found")
+                    st.image(img_data, width=300)
                     if message.get("content"):
                         st.markdown(message["content"])
                 except Exception as e:
@@ -374,23 +898,25 @@ def main():
     if uploaded_file:
         col1, col2 = st.columns([1, 3])
         with col1:
-            image = Image.open(uploaded_file)
-            st.image(image, caption="Ready to send", width=150)
+            # แสดงไฟล์ต้นฉบับ และเริ่ม encode ใน thread pool (prepare_image รอผลตอนส่ง)
+            st.image(uploaded_file, caption="Ready to send", width=150)
+            get_image_preprocessor().submit(uploaded_file.getvalue(), uploaded_file.name)
         with col2:
             st.info(f"📎 {uploaded_file.name} ({uploaded_file.size:,} bytes)")
     
     # Chat input
     if prompt := st.chat_input("Type your message here..."):
         # Process image if uploaded
+        image = None
         image_base64 = None
         message_type = "text"
         
         if uploaded_file:
             try:
-                image = Image.open(uploaded_file)
-                image.thumbnail((800, 600), Image.Resampling.LANCZOS)
-                image_base64 = image_to_base64(image)
-                message_type = "image"
+                image = prepare_image(uploaded_file.getvalue(), uploaded_file.name)
+                if image:
+                    image_base64 = base64.b64encode(image.data).decode()
+                    message_type = "image"
             except Exception as e:
                 st.error(f"Error processing image: {e}")
         
@@ -400,24 +926,25 @@ def main():
             "content": prompt,
             "type": message_type
         }
-        if image_base64:
-            user_message["image"] = image_base64
-        
-        st.session_state.messages.append(user_message)
         
-        # Save to database
-        db_manager.insert_chat_message(
+        # Save the user message (and its image) right away so it survives a failed or interrupted reply
+        work = UnitOfWork()
+        image_hash = work.add_message(
             selected_machine, "user", prompt, message_type, 
-            image_base64, session_id
+            image.data if image else None, session_id,
+            image.mime_type if image else None
         )
+        db_manager.commit_work(work)
+        if image_hash:
+            user_message["image_hash"] = image_hash
+        
+        st.session_state.messages.append(user_message)
         
         # Display user message
         with st.chat_message("user"):
-            if image_base64:
+            if image:
                 try:
-                    img_data = base64.b64decode(image_base64)
-                    image = Image.open(io.BytesIO(img_data))
-                    st.image(image, width=300)
+                    st.image(image.data, width=300)
                 except:
                     pass
             st.markdown(prompt)
@@ -439,13 +966,13 @@ def main():
         }
         st.session_state.messages.append(assistant_message)
         
-        db_manager.insert_chat_message(
-            selected_machine, "assistant", ai_response, "text", 
-            None, session_id
-        )
-        
-        # Log activity
-        db_manager.log_activity(selected_machine, "message_sent", session_id)
+        # Save the reply and the activity in one transaction
+        with db_manager.unit_of_work() as work:
+            work.add_message(
+                selected_machine, "assistant", ai_response, "text", 
+                None, session_id
+            )
+            work.log_activity(selected_machine, "message_sent", session_id)
         
         # Clear uploaded file
         if 'upload_key' not in st.session_state: